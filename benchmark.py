@@ -0,0 +1,79 @@
+"""Definition of the Benchmark class.
+
+A benchmark is a function of the problem, taking an input size (a scale)
+and calling the student code on an input of that size.
+It is run many times at each of its scales, so the median timings show
+how the student code scales. The median timing and the peak memory
+allocation at the largest scale are compared to the benchmark budgets.
+
+"""
+
+from ast_analysis import introspect_test_function
+from commons import SourceError
+
+
+DEFAULT_REPEAT = 5  # number of runs at each scale
+
+
+class Benchmark:
+    """A Benchmark instance is a benchmark function ready to be launched,
+    with its scales and budgets. It should be associated with a Problem.
+
+    """
+    __slots__ = ['source_code', 'author', 'scales', 'time_budget',
+                 'memory_budget', 'repeat', 'name']
+    SourceError = SourceError
+
+    def __init__(self, source_code:str, author:str, scales:iter, time_budget:float,
+                 memory_budget:int=None, repeat:int=DEFAULT_REPEAT, name:str=''):
+        """
+        source_code -- definition of a function named bench_*, expecting a scale
+        scales -- input sizes given to the function
+        time_budget -- seconds allowed to the median run at the largest scale
+        memory_budget -- bytes allowed to be allocated by a run at the
+                         largest scale, or None for no budget
+        repeat -- number of runs at each scale
+
+        """
+        self.source_code = str(source_code).strip() + '\n'
+        self.author = str(author)
+        self.scales = tuple(sorted(map(int, scales)))
+        self.time_budget = float(time_budget)
+        self.memory_budget = None if memory_budget is None else int(memory_budget)
+        self.repeat = int(repeat)
+        assert self.scales and self.repeat > 0
+        self.name = str(name)
+        if not name:
+            self.validate()
+
+    def validate(self) -> None or SourceError:
+        """Introspection of the function. Raise SourceError if anything wrong."""
+        self.name = introspect_test_function(
+            self.source_code, only_one_function=True, name_starts_with='bench_',
+            no_parameter_allowed=False, must_have_one_of=()
+        )[0]
+
+    @property
+    def largest_scale(self) -> int:
+        return self.scales[-1]
+
+    def __str__(self):
+        return str(self.source_code)
+
+
+    @property
+    def fields(self) -> iter:
+        yield from (field.lstrip('_') for field in self.__slots__)
+
+
+    def to_json(self) -> dict:
+        return {'__weldon_Benchmark__': {
+            field: getattr(self, field)
+            for field in self.fields
+        }}
+
+    @staticmethod
+    def from_json(data:dict) -> object:
+        payload = data.get('__weldon_Benchmark__')
+        if payload:
+            return Benchmark(**payload)
@@ -2,10 +2,16 @@
 
 """
 
+import io
+from collections import deque
+
 from utils import jsonable_class
 
 
 TEST_TYPES = {'hidden', 'public', 'community'}
+TEST_STATUSES = {'passed', 'failed', 'error', 'skipped', 'timeout', 'memory'}
+BENCHMARK_STATUSES = {'passed', 'slow', 'memory', 'error', 'timeout'}
+TRUNCATION_MARKER = '\n[... {} bytes truncated ...]\n'
 
 
 class ServerError(Exception):
@@ -19,13 +25,133 @@ class SourceError(Exception):
 
 TestResult = jsonable_class(
     'TestResult',
-    ['_name', '_type', '_succeed'],
+    ['_name', '_type', '_succeed', '_status', '_duration'],
+    defaults={'status': None, 'duration': None},  # unknown by default
+)
+
+# result of a Benchmark:
+#  timings -- pairs (scale, median time in seconds), by increasing scale
+#  peak_memory -- bytes allocated by a run at the largest scale (None if unknown)
+BenchmarkResult = jsonable_class(
+    'BenchmarkResult',
+    ['_name', '_succeed', '_status', '_timings', '_peak_memory'],
+    defaults={'timings': (), 'peak_memory': None},
 )
 
+# resources used by the grader, as measured by the runner (None if unknown):
+#  grading_time -- wall-clock time of the run, in seconds
+#  cpu_time -- CPU time of the grader process, in seconds
+#  peak_memory -- peak resident set size of the grader process, in bytes
 SubmissionResult = jsonable_class(
     'SubmissionResult',
-    ['_tests', '_full_trace', '_problem_id', '_source_code'],
+    ['_tests', '_full_trace', '_problem_id', '_source_code',
+     '_grading_time', '_cpu_time', '_peak_memory', '_benchmarks'],
+    defaults={'grading_time': None, 'cpu_time': None, 'peak_memory': None,
+              'benchmarks': ()},  # BenchmarkResult of the problem benchmarks
     other_attributes={
         'total_success': property(lambda self: all(test.succeed for test in self.tests))
     }
 )
+
+
+class BoundedTrace(io.TextIOBase):
+    """Text stream keeping only the head and the tail of what is written
+    when it exceeds max_size bytes (utf-8 encoded), with a TRUNCATION_MARKER
+    in place of the dropped bytes. No bound if max_size is None.
+
+    """
+
+    def __init__(self, max_size:int=None):
+        self.max_size = max_size
+        self.truncated = 0  # number of dropped bytes
+        self._head, self._tail = [], deque()  # encoded chunks
+        self._head_size, self._tail_size = 0, 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text:str) -> int:
+        data = text.encode(errors='replace')
+        if self.max_size is None:
+            self._head.append(data)
+            return len(text)
+        head_room = self.max_size // 2 - self._head_size
+        if head_room > 0:
+            self._head.append(data[:head_room])
+            self._head_size += len(self._head[-1])
+            data = data[head_room:]
+        if data:
+            self._tail.append(data)
+            self._tail_size += len(data)
+            excess = self._tail_size - (self.max_size - self.max_size // 2)
+            while excess > 0:
+                oldest = self._tail.popleft()
+                if len(oldest) > excess:  # keep its end
+                    self._tail.appendleft(oldest[excess:])
+                dropped = min(excess, len(oldest))
+                self._tail_size -= dropped
+                self.truncated += dropped
+                excess -= dropped
+        return len(text)
+
+    def getvalue(self) -> str:
+        # chunks may have been cut in the middle of a character
+        head = b''.join(self._head).decode(errors='ignore')
+        tail = b''.join(self._tail).decode(errors='ignore')
+        if self.truncated:
+            return head + TRUNCATION_MARKER.format(self.truncated) + tail
+        return head + tail
+
+
+def updated_submission_result(result:SubmissionResult, **fields) -> SubmissionResult:
+    """Return a copy of given result, with given fields replaced"""
+    values = {field: getattr(result, field) for field in result.fields}
+    values.update(fields)
+    return SubmissionResult(**values)
+
+
+def bounded_trace(text:str, max_size:int=None) -> str:
+    """Return given text, truncated like a BoundedTrace of given max size"""
+    if max_size is None or len(text) * 4 <= max_size:  # no need to encode it
+        return text
+    trace = BoundedTrace(max_size)
+    trace.write(text)
+    return trace.getvalue()
+
+
+def merge_submission_results(base:SubmissionResult, update:SubmissionResult,
+                             max_trace_size:int=None) -> SubmissionResult:
+    """Return the result of base, updated with the tests of update.
+
+    Tests of update replace the tests of same name and type in base,
+    and new tests are added at the end ; the same goes for benchmarks.
+    The merged trace is bounded to given max size (see BoundedTrace).
+    Resources used by both gradings are added up.
+
+    """
+    updated = {(test.type, test.name): test for test in update.tests}
+    tests = [updated.pop((test.type, test.name), test) for test in base.tests]
+    tests.extend(test for test in update.tests if (test.type, test.name) in updated)
+    updated = {bench.name: bench for bench in update.benchmarks}
+    benchmarks = [updated.pop(bench.name, bench) for bench in base.benchmarks]
+    benchmarks.extend(bench for bench in update.benchmarks if bench.name in updated)
+    return SubmissionResult(tests=tests,
+                            full_trace=bounded_trace(base.full_trace + '\n' + update.full_trace,
+                                                     max_trace_size),
+                            problem_id=base.problem_id, source_code=base.source_code,
+                            grading_time=sum_known(base.grading_time, update.grading_time),
+                            cpu_time=sum_known(base.cpu_time, update.cpu_time),
+                            peak_memory=max_known(base.peak_memory, update.peak_memory),
+                            benchmarks=benchmarks)
+
+
+def sum_known(*values:float) -> float or None:
+    """Sum of the given values that are not None ; None if all are"""
+    values = tuple(value for value in values if value is not None)
+    return sum(values) if values else None
+
+
+def max_known(*values:float) -> float or None:
+    """Max of the given values that are not None ; None if all are"""
+    values = tuple(value for value in values if value is not None)
+    return max(values) if values else None
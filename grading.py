@@ -0,0 +1,368 @@
+"""Implementation of the grading engine, allowing Server to test
+many submissions at the same time.
+
+Each grading job is run by a worker process of a pool,
+in its own scratch directory, removed once the job is done.
+With the zygote runner, workers are the children of a zygote
+dedicated to the problem (see zygote.py).
+
+Submissions to problems with many tests are split in shards,
+each running a part of the tests, graded in parallel by different workers.
+
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+from zygote import CLEAN_CONTEXT, Zygote
+from commons import SubmissionResult, bounded_trace, max_known, sum_known
+from run_pytest import (RUNNERS as PYTEST_RUNNERS, DEFAULT_LIMITS, Limits,
+                        apply_rlimits, discard_tree, materialization_dir,
+                        ram_scratch_root, result_from_pytest)
+
+
+# children of zygotes can be killed, so a bad submission can't hang a worker
+DEFAULT_RUNNER = 'zygote'
+RUNNERS = PYTEST_RUNNERS | {'zygote'}
+# below, the cost of the additional runs is higher than the gain
+DEFAULT_SHARDING_THRESHOLD = 100
+# zygotes kept alive, for the problems (and shards, and restrictions) last used
+DEFAULT_MAX_ZYGOTES = 16
+
+
+def grade(problem, source_code:str, scratch_root:str=None,
+          runner:str=DEFAULT_RUNNER, limits:Limits=DEFAULT_LIMITS,
+          tests_cache:str=None, dry:bool=False,
+          priority_tests:tuple=()) -> SubmissionResult:
+    """Grading job: run tests of given problem on given source code,
+    in an isolated run directory.
+
+    """
+    if runner == 'inprocess':  # the worker is the grader process
+        apply_rlimits(Limits(memory=limits.memory))
+    return result_from_pytest(problem, source_code, run_dir=None,
+                              scratch_root=scratch_root, runner=runner,
+                              limits=limits, tests_cache=tests_cache,
+                              dry=dry, priority_tests=priority_tests)
+
+
+def shards_of(problem, nb_shards:int) -> tuple:
+    """Return the nb_shards problems (or less) having each a contiguous part
+    of the tests of given one. Benchmarks are all run by the last shard.
+
+    """
+    tests = problem.tests
+    nb_shards = max(1, min(nb_shards, len(tests)))
+    bounds = [len(tests) * idx // nb_shards for idx in range(nb_shards + 1)]
+    return tuple(problem.restricted_to(tests[start:stop],
+                                       problem.benchmarks if stop == len(tests) else ())
+                 for start, stop in zip(bounds, bounds[1:]))
+
+
+def merge_shard_results(problem, results:[SubmissionResult],
+                        max_trace_size:int=None) -> SubmissionResult:
+    """Return the result of given problem made of the results of its shards,
+    with tests in the order of a run of the full test suite,
+    and traces joined in a trace of given max size.
+    Shards ran in parallel, so the grading time is the one of the slowest.
+
+    """
+    # pytest runs test files in alphabetical order, then tests in file order
+    order = {(test.type, test.name[len('test_'):]): idx for idx, test
+             in enumerate(sorted(problem.tests, key=lambda test: test.type))}
+    tests = sorted((test for result in results for test in result.tests),
+                   key=lambda test: order.get((test.type, test.name.split('[')[0]),
+                                              len(order)))
+    return SubmissionResult(tests=tests,
+                            full_trace=bounded_trace('\n'.join(
+                                result.full_trace for result in results
+                            ), max_trace_size),
+                            problem_id=problem.id,
+                            source_code=results[0].source_code,
+                            grading_time=max_known(*(r.grading_time for r in results)),
+                            cpu_time=sum_known(*(r.cpu_time for r in results)),
+                            peak_memory=max_known(*(r.peak_memory for r in results)),
+                            benchmarks=[bench for r in results for bench in r.benchmarks])
+
+
+def gathered(problem, futures:[Future], max_trace_size:int=None) -> Future:
+    """Return a future on the merge of the results of given shards futures,
+    failing as soon as one of them fails.
+
+    """
+    merged = Future()
+    merged.set_running_or_notify_cancel()
+    remaining, lock = [len(futures)], threading.Lock()
+    def on_shard_done(future:Future):
+        with lock:
+            if merged.done():
+                return
+            if future.exception() is not None:
+                merged.set_exception(future.exception())
+                return
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            merged.set_result(merge_shard_results(
+                problem, [future.result() for future in futures], max_trace_size))
+        except Exception as err:
+            merged.set_exception(err)
+    for future in futures:
+        future.add_done_callback(on_shard_done)
+    return merged
+
+
+class GradingPool:
+    """Pool of worker processes running grading jobs in parallel.
+
+    The underlying pool is created at first use, so a Server that never
+    receives a submission never spawns a process.
+
+    """
+
+    def __init__(self, nb_workers:int=None, scratch_root:str=None,
+                 runner:str=DEFAULT_RUNNER, limits:Limits=DEFAULT_LIMITS,
+                 sharding_threshold:int=DEFAULT_SHARDING_THRESHOLD,
+                 max_zygotes:int=None):
+        """
+        nb_workers -- number of jobs run in parallel (default: number of cores),
+                      whatever their problems ; with the zygote runner,
+                      submitting waits for one of the running jobs to end
+        scratch_root -- directory where jobs scratch directories are created
+                        (default: run_pytest.RAM_SCRATCH_ROOT if available,
+                        so jobs do not wait for the disk, else the system
+                        temporary directory)
+        runner -- how pytest is run by workers (see run_pytest.RUNNERS),
+                  or 'zygote' to fork workers from a warm zygote per problem
+        limits -- the run_pytest.Limits applied to each grading. With the
+                  inprocess runner, only timeouts and memory are enforced,
+                  and a submission escaping the timeouts will hang its worker.
+                  A submission killing its worker fails the jobs running
+                  with it, and the workers are recreated for the next ones.
+        sharding_threshold -- number of tests from which a submission is split
+                              in one shard per worker ; 0 disables sharding.
+                              The submission timeout applies to each shard.
+        max_zygotes -- number of zygotes kept alive, the least recently used
+                       being closed (default: DEFAULT_MAX_ZYGOTES, or twice
+                       the number of workers if more, so all shards fit) ;
+                       also the number of materialized tests kept, the least
+                       recently used being deleted once no longer used.
+                       Tests of older versions of a problem are deleted
+                       as soon as they are no longer used.
+
+        """
+        self.nb_workers = int(nb_workers or os.cpu_count() or 1)
+        self.scratch_root = scratch_root if scratch_root else ram_scratch_root()
+        self.runner = str(runner)
+        self.limits = Limits(*limits)
+        self.sharding_threshold = int(sharding_threshold)
+        self.max_zygotes = int(max_zygotes or max(DEFAULT_MAX_ZYGOTES, 2 * self.nb_workers))
+        assert self.runner in RUNNERS, self.runner
+        self._executor = None
+        self._tests_cache = None  # directory of materialized tests, shared by workers
+        # (problem id, shard, test suite hash): Zygote, least recently used first
+        self._zygotes = OrderedDict()
+        self._retiring = []  # threads closing the zygotes no longer used
+        # materialized tests dir: [problem id, version, number of users],
+        #  least recently used first
+        self._tests_dirs = OrderedDict()
+        # jobs sent to zygotes, all problems and shards included
+        self._zygote_jobs = threading.BoundedSemaphore(self.nb_workers)
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.nb_workers,
+                                                     mp_context=CLEAN_CONTEXT)
+            return self._executor
+
+    @property
+    def tests_cache(self) -> str:
+        with self._lock:
+            if self._tests_cache is None:
+                self._tests_cache = tempfile.mkdtemp(prefix='weldon-tests-',
+                                                     dir=self.scratch_root)
+            return self._tests_cache
+
+    def zygote(self, problem, shard:int=None) -> Zygote:
+        """Return the zygote of given problem (or of given shard of it),
+        created if its tests are new, or if the last one died.
+
+        """
+        tests_cache = self.tests_cache
+        with self._lock:
+            zygote, outdated = self._up_to_date_zygote(problem, shard, tests_cache)
+        self._retire(outdated)
+        return zygote
+
+    def _up_to_date_zygote(self, problem, shard:int, tests_cache:str) -> (Zygote, [Zygote]):
+        """Return the zygote of given problem (or of given shard of it),
+        and the zygotes it makes outdated, that must be closed:
+        the dead one it replaces, those of older versions of the problem,
+        and the least recently used ones above max_zygotes.
+
+        Must be called with the lock held.
+
+        """
+        key = problem.id, shard, problem.test_suite_hash
+        zygote = self._zygotes.get(key)
+        if zygote is not None and zygote.alive:
+            self._zygotes.move_to_end(key)
+            return zygote, []
+        outdated = [] if zygote is None else [zygote]
+        self._use_tests_dir(problem, tests_cache)  # until the zygote is closed
+        zygote = self._zygotes[key] = Zygote(problem, self.scratch_root,
+                                             max_children=self.nb_workers,
+                                             limits=self.limits, tests_cache=tests_cache)
+        self._zygotes.move_to_end(key)
+        for other_key, other in tuple(self._zygotes.items()):
+            if other_key[0] == problem.id and other.problem.version < problem.version:
+                outdated.append(self._zygotes.pop(other_key))
+        while len(self._zygotes) > self.max_zygotes:
+            outdated.append(self._zygotes.popitem(last=False)[1])
+        return zygote, outdated
+
+    def _use_tests_dir(self, problem, tests_cache:str) -> str:
+        """Return the materialized tests dir of given problem, now used
+        until given to _release_tests_dir.
+
+        Must be called with the lock held.
+
+        """
+        tests_dir = materialization_dir(problem, tests_cache)
+        usage = self._tests_dirs.setdefault(tests_dir, [problem.id, problem.version, 0])
+        usage[2] += 1
+        self._tests_dirs.move_to_end(tests_dir)
+        return tests_dir
+
+    def _release_tests_dir(self, tests_dir:str):
+        """Stop using given tests dir, deleting the tests dirs no longer needed:
+        the unused ones of older versions of their problem, and the least
+        recently used unused ones while there are more than max_zygotes.
+
+        """
+        with self._lock:
+            if tests_dir in self._tests_dirs:
+                self._tests_dirs[tests_dir][2] -= 1
+            last_versions = {}
+            for problem_id, version, _ in self._tests_dirs.values():
+                last_versions[problem_id] = max(version, last_versions.get(problem_id, version))
+            outdated, unused = [], []
+            for other, (problem_id, version, users) in self._tests_dirs.items():
+                if not users:
+                    (outdated if version < last_versions[problem_id] else unused).append(other)
+            excess = len(self._tests_dirs) - len(outdated) - self.max_zygotes
+            outdated += unused[:max(0, excess)]
+            for tests_dir in outdated:
+                del self._tests_dirs[tests_dir]
+        for tests_dir in outdated:
+            discard_tree(tests_dir, os.path.dirname(tests_dir))
+
+    def _close(self, zygotes:[Zygote]):
+        for zygote in zygotes:
+            zygote.close()
+            self._release_tests_dir(materialization_dir(zygote.problem,
+                                                        zygote.tests_cache))
+
+    def _retire(self, zygotes:[Zygote]):
+        """Close given zygotes in background, once their running jobs are done"""
+        if not zygotes:
+            return
+        thread = threading.Thread(target=self._close, args=(zygotes,), daemon=True)
+        thread.start()
+        with self._lock:
+            self._retiring = [other for other in self._retiring if other.is_alive()]
+            self._retiring.append(thread)
+
+    def submit(self, problem, source_code:str, *, dry:bool=False,
+               priority_tests:iter=()) -> Future:
+        """Return a future on the SubmissionResult of given source code.
+
+        dry -- stop at the first failing test, running first the tests
+               named in priority_tests (see run_pytest.result_from_pytest).
+
+        """
+        priority_tests = tuple(priority_tests)
+        if dry:  # sharding would run more than needed
+            return self._submit(problem, source_code, dry=dry,
+                                priority_tests=priority_tests)
+        if (self.sharding_threshold > 0 and self.nb_workers > 1
+                and len(problem.tests) >= self.sharding_threshold):
+            shards = shards_of(problem, self.nb_workers)
+            return gathered(problem, [
+                self._submit(shard, source_code, shard=idx)
+                for idx, shard in enumerate(shards)
+            ], self.limits.trace_size)
+        return self._submit(problem, source_code)
+
+    def _submit(self, problem, source_code:str, shard:int=None, *,
+                dry:bool=False, priority_tests:tuple=()) -> Future:
+        if self.runner == 'zygote':
+            tests_cache = self.tests_cache
+            # no more than nb_workers children at once, whatever their zygotes
+            self._zygote_jobs.acquire()
+            try:
+                # job is sent under the lock, so the zygote can't be replaced
+                #  and closed by another thread before receiving it
+                with self._lock:
+                    zygote, outdated = self._up_to_date_zygote(problem, shard, tests_cache)
+                    future = zygote.submit(str(source_code), dry=dry,
+                                           priority_tests=priority_tests)
+            except BaseException:
+                self._zygote_jobs.release()
+                raise
+            future.add_done_callback(lambda _: self._zygote_jobs.release())
+            self._retire(outdated)
+            return future
+        tests_cache = self.tests_cache
+        job = (grade, problem, str(source_code), self.scratch_root, self.runner,
+               self.limits, tests_cache, dry, priority_tests)
+        with self._lock:
+            tests_dir = self._use_tests_dir(problem, tests_cache)
+        try:
+            future = self._submit_job(job)
+        except BaseException:
+            self._release_tests_dir(tests_dir)
+            raise
+        future.add_done_callback(lambda _: self._release_tests_dir(tests_dir))
+        return future
+
+    def _submit_job(self, job:tuple) -> Future:
+        executor = self.executor
+        try:
+            return executor.submit(*job)
+        except BrokenProcessPool:  # a job killed its worker, with os._exit for instance
+            with self._lock:
+                if self._executor is executor:  # not already replaced
+                    self._executor = None
+            executor.shutdown(wait=False)
+            return self.executor.submit(*job)
+
+    def grade(self, problem, source_code:str, **kwargs) -> SubmissionResult:
+        """Return the SubmissionResult of given source code, once computed"""
+        return self.submit(problem, source_code, **kwargs).result()
+
+    def shutdown(self, wait:bool=True):
+        """Stop the workers ; the pool will be recreated if used again"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            zygotes, self._zygotes = tuple(self._zygotes.values()), OrderedDict()
+            retiring, self._retiring = self._retiring, []
+            tests_cache, self._tests_cache = self._tests_cache, None
+            self._tests_dirs = OrderedDict()
+        if executor:
+            executor.shutdown(wait=wait)
+        for zygote in zygotes:
+            zygote.close()
+        for thread in retiring:
+            thread.join()
+        if tests_cache:
+            shutil.rmtree(tests_cache, ignore_errors=True)
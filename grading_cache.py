@@ -0,0 +1,86 @@
+"""Implementation of the cache of grading results.
+
+A submission result only depends on the source code and on the tests
+of the problem, so a source code already graded against the same tests
+do not need to be graded again.
+Except when a limit interrupted it: its timings and memory usage depend
+on the load of the server, so it is graded again on next submission.
+
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from commons import SubmissionResult
+
+
+DEFAULT_CACHE_SIZE = 1024
+# statuses of tests and benchmarks that another grading may not give ;
+#  graders killed by a signal because too long or too big get 'timeout'
+LOAD_DEPENDENT_STATUSES = {'timeout', 'memory', 'slow'}
+
+
+def is_cacheable(result:SubmissionResult) -> bool:
+    """True if given result does not depend on the load of the server"""
+    return not any(run.status in LOAD_DEPENDENT_STATUSES
+                   for run in (*result.tests, *result.benchmarks))
+
+
+class GradingCache:
+    """LRU mapping (problem, test suite, source code) to SubmissionResult,
+    counting hits and misses.
+
+    """
+
+    def __init__(self, maxsize:int=DEFAULT_CACHE_SIZE):
+        """
+        maxsize -- number of results kept ; 0 disables the cache
+
+        """
+        self.maxsize = int(maxsize)
+        self.hits, self.misses = 0, 0
+        self._results = OrderedDict()  # key: SubmissionResult, oldest first
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(problem, source_code:str) -> (int, str, str):
+        """Return the key of given source code for given problem"""
+        source_hash = hashlib.sha256(str(source_code).encode()).hexdigest()
+        return problem.id, problem.test_suite_hash, source_hash
+
+    def get(self, problem, source_code:str) -> SubmissionResult or None:
+        """Return the result of given source code, or None if unknown"""
+        key = self.key(problem, source_code)
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._results.move_to_end(key)
+            return result
+
+    def put(self, problem, source_code:str, result:SubmissionResult):
+        """Remember given result, evicting the least recently used if needed.
+        Results depending on the load of the server are ignored."""
+        if self.maxsize <= 0 or not is_cacheable(result):
+            return
+        key = self.key(problem, source_code)
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    @property
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._results), 'maxsize': self.maxsize}
+
+    def __len__(self) -> int:
+        return len(self._results)
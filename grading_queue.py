@@ -0,0 +1,142 @@
+"""Implementation of the asynchronous grading of submissions.
+
+A submission sent asynchronously becomes a GradingJob, identified by a
+job id given back immediately to the player, that can then poll the status
+and the result of the job while worker threads grade it.
+
+Jobs are scheduled round-robin between players, so a player sending
+many submissions do not delay the others. A job still waiting for a worker
+is superseded (and dropped) when its player submits again for the same problem.
+
+"""
+
+import uuid
+import threading
+from collections import deque, OrderedDict
+
+from commons import SubmissionResult
+
+
+JOB_STATUSES = {'queued', 'running', 'done', 'failed', 'superseded'}
+FINISHED_STATUSES = {'done', 'failed', 'superseded'}
+MAX_FINISHED_JOBS = 10000
+
+
+class GradingJob:
+    """A submission waiting for, or having received, its grading"""
+    __slots__ = ['id', 'token', 'problem_id', 'source_code',
+                 'status', 'result', 'error', 'superseded_by', '_finished']
+
+    def __init__(self, token:str, problem_id:int, source_code:str):
+        self.id = str(uuid.uuid4())
+        self.token = token
+        self.problem_id = problem_id
+        self.source_code = str(source_code)
+        self.status = 'queued'
+        self.result = None  # SubmissionResult, once done
+        self.error = None  # error message, if failed
+        self.superseded_by = None  # id of the job replacing this one
+        self._finished = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def wait(self, timeout:float=None) -> bool:
+        """Wait for the job to be finished ; return False on timeout"""
+        return self._finished.wait(timeout)
+
+
+class GradingQueue:
+    """Queue of GradingJob, consumed by worker threads.
+
+    Workers do not grade by themselves: they call the given grade function,
+    which is expected to dispatch the work to the grading pool.
+
+    """
+
+    def __init__(self, grade:callable, nb_workers:int=1,
+                 max_finished_jobs:int=MAX_FINISHED_JOBS):
+        """
+        grade -- callable (token, problem id, source code) -> SubmissionResult
+        nb_workers -- number of jobs handled at the same time
+        max_finished_jobs -- number of finished jobs kept for polling
+
+        """
+        self._grade = grade
+        self.nb_workers = int(nb_workers)
+        self.max_finished_jobs = int(max_finished_jobs)
+        self._queues = OrderedDict()  # token: jobs waiting for a worker, next token first
+        self._jobs = {}  # job id: GradingJob
+        self._finished = OrderedDict()  # job id of finished jobs, oldest first
+        self._condition = threading.Condition()
+        self._workers = []
+
+    def put(self, token:str, problem_id:int, source_code:str) -> GradingJob:
+        """Create and enqueue a new job, superseding the waiting jobs
+        of same player and problem.
+
+        """
+        job = GradingJob(token, problem_id, source_code)
+        with self._condition:
+            self._jobs[job.id] = job
+            queue = self._queues.setdefault(token, deque())
+            for old_job in tuple(queue):
+                if old_job.problem_id == problem_id:
+                    queue.remove(old_job)
+                    old_job.superseded_by = job.id
+                    self._finish(old_job, 'superseded')
+            queue.append(job)
+            self._start_workers()
+            self._condition.notify()
+        return job
+
+    def job(self, job_id:str) -> GradingJob or None:
+        return self._jobs.get(job_id)
+
+    def __len__(self) -> int:
+        """Number of jobs waiting for a worker"""
+        return sum(map(len, self._queues.values()))
+
+    def _start_workers(self):
+        """Start the workers that are not running yet"""
+        while len(self._workers) < self.nb_workers:
+            worker = threading.Thread(target=self._work, daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def _next_job(self) -> GradingJob:
+        """Wait for and return the next job to grade, taken from the queue
+        of the next player, that is then moved at the end of the round.
+
+        """
+        with self._condition:
+            while not self._queues:
+                self._condition.wait()
+            token, queue = self._queues.popitem(last=False)
+            job = queue.popleft()
+            if queue:  # player will be served again after the others
+                self._queues[token] = queue
+            job.status = 'running'
+            return job
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            try:
+                job.result = self._grade(job.token, job.problem_id, job.source_code)
+                assert isinstance(job.result, SubmissionResult)
+                self._finish(job, 'done')
+            except Exception as err:
+                job.error = '|'.join(map(str, err.args)) or type(err).__name__
+                self._finish(job, 'failed')
+
+    def _finish(self, job:GradingJob, status:str):
+        """Set the final status of given job, forgetting the oldest finished ones"""
+        with self._condition:
+            job.status = status
+            job._finished.set()
+            self._finished[job.id] = None
+            while len(self._finished) > self.max_finished_jobs:
+                job_id, _ = self._finished.popitem(last=False)
+                del self._jobs[job_id]
@@ -206,6 +206,13 @@ class WeldonInterface(tk.Frame):
 
     def __init_widget_problems(self):
         self.available_problems = tuple(self.client.list_problems()) if self.client else ()
+        self.problem_descriptions = {}  # problem name: description
+        if self.available_problems:  # all retrieved in one transaction
+            with self.client.batch():
+                problems = {name: self.client.retrieve_problem(problem_id=name)
+                            for name in self.available_problems}
+            self.problem_descriptions = {name: problem.result().description
+                                         for name, problem in problems.items()}
         if self.lst_problems_trace:
             try:
                 self.lst_problems_text.trace_remove(*self.lst_problems_trace)
@@ -217,8 +224,7 @@ class WeldonInterface(tk.Frame):
             problem_name = self.lst_problems_text.get()
             if problem_name in self.available_problems:
                 if self.__validate_current_state(validate_code=False, validate_problem=False):
-                    problem = self.client.retrieve_problem(problem_id=problem_name)
-                    self.lab_sourcecode_text.set(problem.description)
+                    self.lab_sourcecode_text.set(self.problem_descriptions[problem_name])
         try:  # first try the new way
             trace = self.lst_problems_text.trace_add('write', callback)
             self.lst_problems_trace = 'write', trace
@@ -0,0 +1,179 @@
+"""Implementation of the journal of the Server state.
+
+Every change of the Server state is an event, appended to the journal
+before the API call returns. Events are written by a dedicated thread,
+that commits in one write and one fsync all the events appended
+meanwhile (group commit), so concurrent calls share the cost of the disk.
+
+Periodically, a snapshot of the whole state is written, and the journal
+files it covers are removed. At restart, the state is loaded from the last
+snapshot, and only the events appended after it are replayed.
+
+"""
+
+import os
+import json
+import threading
+
+import wjson
+
+
+SNAPSHOT_FILE = 'snapshot.json'
+JOURNAL_PREFIX = 'journal-'  # followed by the sequence number of its first event
+SNAPSHOT_INTERVAL = 1000  # number of events between two snapshots
+
+
+class Journal:
+    """Append-only journal of events, stored in a directory
+    with the last snapshot.
+
+    Events are lists of json serializable data (see wjson),
+    each identified by a sequence number.
+
+    """
+
+    def __init__(self, directory:str, snapshot_interval:int=SNAPSHOT_INTERVAL):
+        self.directory = str(directory)
+        self.snapshot_interval = int(snapshot_interval)
+        os.makedirs(self.directory, exist_ok=True)
+        self._condition = threading.Condition()
+        self._buffer = []  # (sequence number, line) to write, or (None, new journal file)
+        self._last_seq = self._snapshot_seq = 0
+        self._committed_seq = 0
+        self._closed = False
+        self._file = None
+        self._writer = None
+
+    def recover(self) -> (dict or None, [list]):
+        """Return the state found in the last snapshot (None if no snapshot),
+        and the events appended after it.
+
+        Must be called once, before any event is appended.
+
+        """
+        state, self._snapshot_seq = None, 0
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path) as fd:
+                snapshot = wjson.from_json(fd.read())
+            state, self._snapshot_seq = snapshot['state'], snapshot['seq']
+        events, self._last_seq = [], self._snapshot_seq
+        for path in self._journal_files():
+            with open(path) as fd:
+                for line in fd:
+                    try:
+                        seq, *event = wjson.from_json(line)
+                    except json.JSONDecodeError:  # last write was interrupted
+                        break
+                    if seq > self._snapshot_seq:
+                        events.append(event)
+                        self._last_seq = seq
+        self._committed_seq = self._last_seq
+        return state, events
+
+    def append(self, *event) -> int:
+        """Enqueue given event, and return its sequence number.
+        Use wait() to ensure the event is written on disk.
+
+        Calls must be made in the order the events are applied to the state.
+
+        """
+        with self._condition:
+            assert not self._closed, "journal is closed"
+            if self._writer is None:
+                self._start_writer()
+            self._last_seq += 1
+            self._buffer.append((self._last_seq, wjson.as_json([self._last_seq, *event])))
+            self._condition.notify_all()
+            return self._last_seq
+
+    def wait(self, seq:int):
+        """Wait for the event of given sequence number to be written on disk"""
+        with self._condition:
+            while self._committed_seq < seq and not self._closed:
+                self._condition.wait()
+
+    @property
+    def snapshot_needed(self) -> bool:
+        return self._last_seq - self._snapshot_seq >= self.snapshot_interval
+
+    def rotate(self) -> int:
+        """Make the next events go in a new journal file,
+        and return the sequence number of the last event of the previous ones.
+
+        Must be called while the state can't change, the state being
+        then the one to write with write_snapshot.
+
+        """
+        with self._condition:
+            self._buffer.append((None, self._journal_path(self._last_seq + 1)))
+            self._condition.notify_all()
+            return self._last_seq
+
+    def write_snapshot(self, state:dict, seq:int):
+        """Write given state as the snapshot covering the events up to given
+        sequence number (see rotate), then remove the journal files it covers.
+
+        """
+        self.wait(seq)
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        with open(path + '.tmp', 'w') as fd:
+            fd.write(wjson.as_json({'seq': seq, 'state': state}))
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(path + '.tmp', path)
+        self._snapshot_seq = seq
+        for journal_path in self._journal_files():
+            if int(journal_path.rsplit('-', 1)[1]) <= seq:
+                os.remove(journal_path)
+
+    def close(self):
+        """Write the pending events and stop the writer"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._writer:
+            self._writer.join()
+
+    def _journal_path(self, first_seq:int) -> str:
+        return os.path.join(self.directory, '{}{:012d}'.format(JOURNAL_PREFIX, first_seq))
+
+    def _journal_files(self) -> [str]:
+        """Paths to journal files, in writing order"""
+        return sorted(os.path.join(self.directory, filename)
+                      for filename in os.listdir(self.directory)
+                      if filename.startswith(JOURNAL_PREFIX))
+
+    def _start_writer(self):
+        self._file = open(self._journal_path(self._last_seq + 1), 'a')
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+
+    def _write(self):
+        """Write the enqueued events, all at once, until closed"""
+        while True:
+            with self._condition:
+                while not self._buffer and not self._closed:
+                    self._condition.wait()
+                if not self._buffer:  # closed
+                    self._file.close()
+                    return
+                buffer, self._buffer = self._buffer, []
+            committed = None
+            for seq, line in buffer:
+                if seq is None:  # journal rotation
+                    self._sync()
+                    self._file.close()
+                    self._file = open(line, 'a')
+                else:
+                    self._file.write(line)
+                    committed = seq
+            self._sync()
+            with self._condition:
+                if committed is not None:
+                    self._committed_seq = committed
+                self._condition.notify_all()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
@@ -17,6 +17,7 @@ from bashplotlib.histogram import plot_hist
 
 
 MAX_PLOT_HEIGHT = 20
+NB_SLOWEST_TESTS = 3
 
 
 def __transform_data(data:list) -> list:
@@ -68,6 +69,8 @@ def make_report_on_player(name:str, token:str,
     yield ''
     yield '#' * 10 + ' Final submission ' + '#' * 10
     yield from stats_on_tests(name, token, problem, submissions)
+    yield from stats_on_grading(submissions)
+    yield from stats_on_benchmarks(problem, submissions)
 
     # coding style (pylint)
     pylint_report = run_pylint_on_source(final_submission.source_code,
@@ -102,6 +105,52 @@ def stats_on_tests(name, token, problem, submissions) -> iter:
 
 
 
+def stats_on_grading(submissions) -> iter:
+    """Yield lines describing the resources used to grade the submissions"""
+    last_submission = submissions[-1]
+    yield 'GRADING:'
+    if last_submission.grading_time is not None:
+        cpu_time, peak_memory = last_submission.cpu_time, last_submission.peak_memory
+        yield '\tFinal submission: {:.2f}s (CPU {}), peak memory {}'.format(
+            last_submission.grading_time,
+            'unknown' if cpu_time is None else '{:.2f}s'.format(cpu_time),
+            'unknown' if peak_memory is None else '{:.1f} MiB'.format(peak_memory / 2 ** 20))
+    times = tuple(sub.grading_time for sub in submissions if sub.grading_time is not None)
+    if times:
+        yield '\tAll submissions: {:.2f}s in total, {:.2f}s at most'.format(sum(times), max(times))
+    timed_tests = sorted((test for test in last_submission.tests if test.duration is not None),
+                         key=lambda test: test.duration, reverse=True)
+    if timed_tests:
+        yield '\tSlowest tests: ' + ', '.join(
+            '{} {} ({:.2f}s)'.format(test.type, test.name, test.duration)
+            for test in timed_tests[:NB_SLOWEST_TESTS]
+        )
+
+
+def stats_on_benchmarks(problem, submissions) -> iter:
+    """Yield lines describing the benchmarks results of the last submission"""
+    if not problem.benchmarks:
+        return
+    results = {result.name: result for result in submissions[-1].benchmarks}
+    yield 'BENCHMARKS:'
+    for benchmark in problem.benchmarks:
+        result = results.get(benchmark.name)
+        if result is None:
+            yield '\t{}: not run'.format(benchmark.name)
+            continue
+        yield '\t{}: {} (budget: {}s{})'.format(
+            benchmark.name, result.status, benchmark.time_budget,
+            '' if benchmark.memory_budget is None
+            else ', {:.1f} MiB'.format(benchmark.memory_budget / 2 ** 20)
+        )
+        if result.timings:
+            yield '\t\tmedian times: ' + ', '.join(
+                '{:.4f}s at {}'.format(timing, scale) for scale, timing in result.timings
+            )
+        if result.peak_memory is not None:
+            yield '\t\tpeak memory: {:.1f} MiB'.format(result.peak_memory / 2 ** 20)
+
+
 def _nb_tests_sent_by(token:str, tests) -> int:
     return len(tuple(test for test in tests if test.author == token))
 
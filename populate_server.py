@@ -20,17 +20,20 @@ def populate_with(title:str, conn:Client):
     )
 
 def copopulate(conn:Client):
-    """Coroutine version, allowing client to perform one at a time
-    modification of remote server
+    """Coroutine version, allowing client to get one at a time
+    the results of the modification of remote server,
+    performed all together in one transaction
 
     """
-    for title, (desc, public, hidden) in PROBLEMS.items():
-        yield conn.register_problem(
+    with conn.batch():
+        registered = [conn.register_problem(
             title,
             desc,
             public_tests=public,
             hidden_tests=hidden,
-        )
+        ) for title, (desc, public, hidden) in PROBLEMS.items()]
+    for result in registered:
+        yield result.result()
 
 
 PROBLEMS = {
@@ -3,31 +3,76 @@
 """
 
 import os
+import hashlib
 from wtest import Test
+from benchmark import Benchmark
 
 
 class Problem:
-    """Definition of a problem, notabily description and unit tests"""
-    __slots__ = ['_id', '_title', '_description', '_public_tests',
-                 '_hidden_tests', '_community_tests',
-                 '_source_name', '_author']
+    """Definition of a problem, notabily description, unit tests
+    and benchmarks.
+
+    A Problem is immutable: adding a test gives the next version of the
+    problem. Versions share their tests: the lists of tests are only
+    appended, each version knowing how many of them are its own, and an
+    index gives the type and position of each test by name.
+    Anything derived from a version (tuples of tests, public data, json)
+    is therefore computed once, and cached.
+
+    """
+    FIELDS = ('id', 'title', 'description', 'public_tests', 'hidden_tests',
+              'community_tests', 'source_name', 'author', 'benchmarks', 'version')
+    __slots__ = ['_id', '_title', '_description', '_source_name', '_author',
+                 '_benchmarks', '_version',
+                 '_suites',  # test type: list of tests, shared by versions
+                 '_sizes',  # test type: number of tests in this version
+                 '_tests_by_name',  # test name: (type, position), shared by versions
+                 '_cache']
 
     def __init__(self, id:int, title:str, description:str, public_tests:iter,
                  hidden_tests:iter, source_name:str=None, author:str=None,
-                 community_tests:iter=()):
+                 community_tests:iter=(), benchmarks:[Benchmark]=(), version:int=1):
         self._id = int(id)
         self._title = str(title)
         self._description = str(description)
         self._author = str(author or 'unknow')
         self._source_name = str(source_name or 'problem{}'.format(self.id))
-
-        self._public_tests = Test.to_test_suite(public_tests, author=self._author, type='public')
-        self._hidden_tests = Test.to_test_suite(hidden_tests, author=self._author, type='hidden')
-        self._community_tests = Test.to_test_suite(community_tests, author=self._author, type='community')
+        self._version = int(version)
+
+        self._suites = {
+            'public': list(Test.to_test_suite(public_tests, author=self._author, type='public')),
+            'hidden': list(Test.to_test_suite(hidden_tests, author=self._author, type='hidden')),
+            'community': list(Test.to_test_suite(community_tests, author=self._author, type='community')),
+        }
+        self._sizes = {type: len(tests) for type, tests in self._suites.items()}
+        self._tests_by_name = {test.name: (type, position)
+                               for type, tests in self._suites.items()
+                               for position, test in enumerate(tests)}
+        self._cache = {}
+        self._benchmarks = tuple(benchmarks)
+        assert all(isinstance(benchmark, Benchmark) for benchmark in self._benchmarks)
 
     def have_test(self, name:str) -> bool:
         """True if have a test of given name, whatever the type"""
-        return any(name == test.name for test in self.tests)
+        return self.test(name) is not None
+
+    def test(self, name:str) -> Test or None:
+        """Return the test of given name, whatever the type"""
+        type, position = self._tests_by_name.get(name, (None, None))
+        if type is None or position >= self._sizes[type]:  # test of a later version
+            return None
+        return self._suites[type][position]
+
+    def cached(self, name:str, compute:callable) -> object:
+        """Return the value of given name derived from this version,
+        computed by given function if not already"""
+        value = self._cache.get(name)
+        if value is None:
+            value = self._cache[name] = compute()
+        return value
+
+    def _suite(self, type:str) -> (Test,):
+        return self.cached(type, lambda: tuple(self._suites[type][:self._sizes[type]]))
 
 
     @property
@@ -37,13 +82,27 @@ class Problem:
     @property
     def description(self): return self._description
     @property
-    def public_tests(self): return tuple(self._public_tests)
+    def version(self): return self._version
+    @property
+    def public_tests(self): return self._suite('public')
+    @property
+    def hidden_tests(self): return self._suite('hidden')
+    @property
+    def community_tests(self): return self._suite('community')
     @property
-    def hidden_tests(self): return tuple(self._hidden_tests)
+    def tests(self): return self.cached('tests', lambda: self.public_tests + self.hidden_tests
+                                        + self.community_tests)
     @property
-    def community_tests(self): return tuple(self._community_tests)
+    def benchmarks(self): return tuple(self._benchmarks)
     @property
-    def tests(self): return self.public_tests + self.hidden_tests + self.community_tests
+    def test_suite_hash(self) -> str:
+        """Hash identifying the current set of tests (and benchmarks) of the problem"""
+        return self.cached('test_suite_hash', lambda: hashlib.sha256('\0'.join(
+            [test.type + ':' + test.source_code for test in self.tests]
+            + ['benchmark:{}:{}:{}:{}:'.format(bench.scales, bench.time_budget,
+                                               bench.memory_budget, bench.repeat)
+               + bench.source_code for bench in self.benchmarks]
+        ).encode()).hexdigest())
     @property
     def author(self): return self._author
     @property
@@ -51,27 +110,33 @@ class Problem:
 
     @property
     def fields(self) -> iter:
-        yield from (field.lstrip('_') for field in self.__slots__)
+        yield from self.FIELDS
 
 
-    def add_public_test(self, test:Test):
-        """Add a single test to public tests"""
+    def with_test(self, test:Test) -> 'Problem':
+        """Return the next version of the problem, with given test added
+        to the tests of its type"""
         assert isinstance(test, Test)
-        assert test.type == 'public'
+        assert test.type in self._suites
         assert not self.have_test(test.name)
-        self._public_tests += (test,)
-    def add_hidden_test(self, test:Test):
-        """Add a single test to hidden tests"""
-        assert isinstance(test, Test)
-        assert test.type == 'hidden'
-        assert not self.have_test(test.name)
-        self._hidden_tests += (test,)
-    def add_community_test(self, test:Test):
-        """Add a single test to community tests"""
-        assert isinstance(test, Test)
-        assert test.type == 'community'
-        assert not self.have_test(test.name)
-        self._community_tests += (test,)
+        suites, tests_by_name = self._suites, self._tests_by_name
+        if any(len(suites[type]) > size for type, size in self._sizes.items()):
+            # a later version exists: its tests can't be shared
+            suites = {type: tests[:self._sizes[type]] for type, tests in suites.items()}
+            tests_by_name = {name: (type, position) for name, (type, position)
+                             in tests_by_name.items() if position < self._sizes[type]}
+        problem = Problem.__new__(Problem)
+        for slot in ('_id', '_title', '_description', '_source_name',
+                     '_author', '_benchmarks'):
+            setattr(problem, slot, getattr(self, slot))
+        problem._version = self._version + 1
+        problem._suites, problem._tests_by_name = suites, tests_by_name
+        problem._sizes = dict(self._sizes)
+        problem._cache = {}
+        suites[test.type].append(test)
+        tests_by_name[test.name] = test.type, problem._sizes[test.type]
+        problem._sizes[test.type] += 1
+        return problem
 
 
     def source_code_filename(self, dir:str='.') -> str:
@@ -86,14 +151,25 @@ class Problem:
 
     def as_public_data(self):
         """Return the very same object, but without the hidden unit tests"""
-        return Problem(self.id, self.title, self.description, self.public_tests,
-                       '', self.source_name, self.author, self.community_tests)
+        return self.cached('public_data', lambda: Problem(
+            self.id, self.title, self.description, self.public_tests,
+            '', self.source_name, self.author, self.community_tests,
+            self.benchmarks, self.version))
+    def restricted_to(self, tests:[Test], benchmarks:[Benchmark]=()):
+        """Return the very same object, but with only given tests and benchmarks"""
+        tests = tuple(tests)
+        return Problem(self.id, self.title, self.description,
+                       tuple(test for test in tests if test.type == 'public'),
+                       tuple(test for test in tests if test.type == 'hidden'),
+                       self.source_name, self.author,
+                       tuple(test for test in tests if test.type == 'community'),
+                       tuple(benchmarks), self.version)
     def copy(self, id=None):
         """Return the very same object (eventually with overwritten id)"""
         return Problem(id or self.id, self.title, self.description,
-                       tuple(self.public_tests), tuple(self.hidden_tests),
+                       self.public_tests, self.hidden_tests,
                        self.source_name, self.author,
-                       tuple(self.community_tests))
+                       self.community_tests, self.benchmarks, self.version)
 
 
     def to_json(self) -> dict:
@@ -108,10 +184,16 @@ class Problem:
         if payload:
             return Problem(**payload)
 
+    def __reduce__(self):
+        # only the tests of this version, without the cache
+        return Problem, (self.id, self.title, self.description, self.public_tests,
+                         self.hidden_tests, self.source_name, self.author,
+                         self.community_tests, self.benchmarks, self.version)
 
-    def __str__(self) -> str:
-        return ("<Problem '{}', providing {} public, {} hidden"
-                " and {} community tests>"
-                "".format(self.title, len(self.public_tests),
-                          len(self.hidden_tests), len(self.community_tests)))
 
+    def __str__(self) -> str:
+        return ("<Problem '{}' v{}, providing {} public, {} hidden"
+                " and {} community tests, and {} benchmarks>"
+                "".format(self.title, self.version, len(self.public_tests),
+                          len(self.hidden_tests), len(self.community_tests),
+                          len(self.benchmarks)))
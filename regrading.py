@@ -0,0 +1,88 @@
+"""Implementation of the bulk re-grading of a problem.
+
+When tests are added to a problem, the results stored for players
+do not reflect them anymore. A Regrading runs, in background,
+the new tests only against the last submission of every player,
+and gives the updated results back to the Server.
+
+"""
+
+import threading
+from concurrent.futures import as_completed
+
+from commons import merge_submission_results
+
+
+class Regrading:
+    """Background job re-grading the last submissions of a problem
+    on some new tests.
+
+    Regradings of the same problem are chained: a Regrading starts
+    only once the previous one is finished, so it works on the results
+    the previous one stored.
+
+    """
+
+    def __init__(self, problem, new_tests, last_submissions:callable,
+                 submit:callable, store:callable, previous:'Regrading'=None,
+                 max_trace_size:int=None):
+        """
+        problem -- the problem, which tests contains the new tests
+        new_tests -- the tests to run
+        last_submissions -- callable returning the map {token: SubmissionResult}
+                            of last submissions to update
+        submit -- callable (problem, source code) -> Future on SubmissionResult
+        store -- callable (token, last submission, updated result) storing
+                 the updated result
+        previous -- Regrading to wait for before starting
+        max_trace_size -- bytes kept in the trace of updated results
+
+        """
+        self.problem = problem
+        self.new_tests = tuple(new_tests)
+        self.total, self.done, self.errors = 0, 0, 0
+        self._last_submissions = last_submissions
+        self._submit = submit
+        self._store = store
+        self._previous = previous
+        self.max_trace_size = max_trace_size
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    @property
+    def status(self) -> dict:
+        return {'problem_id': self.problem.id, 'total': self.total,
+                'done': self.done, 'errors': self.errors,
+                'new_tests': tuple(test.name for test in self.new_tests),
+                'running': self.running}
+
+    def join(self, timeout:float=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        if self._previous:
+            self._previous.join()
+            self._previous = None  # allow it to be garbage collected
+        restricted_problem = self.problem.restricted_to(self.new_tests)
+        submissions = dict(self._last_submissions())
+        self.total = len(submissions)
+        futures = {
+            self._submit(restricted_problem, submission.source_code): token
+            for token, submission in submissions.items()
+        }
+        for future in as_completed(futures):
+            token = futures[future]
+            try:
+                new_result = future.result()
+            except Exception:  # grading failed ; stored result is kept
+                self.errors += 1
+            else:
+                last_submission = submissions[token]
+                self._store(token, last_submission,
+                            merge_submission_results(last_submission, new_result,
+                                                     self.max_trace_size))
+            self.done += 1
@@ -0,0 +1,85 @@
+"""Implementation of the retention policy of submissions.
+
+By default, all submissions of players are kept in full forever.
+A RetentionPolicy, set per problem, tells how many of the last submissions
+of each player are kept in full: older ones are replaced by summaries,
+giving only the tests passed and the resources used, which is enough
+for the player reports. The submissions of a closed problem can also
+be dropped, once exported.
+
+Policies are applied periodically by a Compactor, in background.
+
+"""
+
+import threading
+import functools
+from collections import namedtuple
+
+from commons import SubmissionResult, TestResult
+
+
+COMPACTION_INTERVAL = 60.  # seconds between two compactions
+
+# full_submissions -- number of last submissions of each player kept in full
+#                     (None: all of them) ; the last one is always kept
+# drop_closed -- drop all submissions of the problem once closed and exported
+RetentionPolicy = namedtuple('RetentionPolicy', 'full_submissions drop_closed')
+KEEP_ALL = RetentionPolicy(full_submissions=None, drop_closed=False)
+
+
+@functools.lru_cache(maxsize=2**14)
+def summary_test_result(name:str, type:str, succeed:bool) -> TestResult:
+    """Return a TestResult with no status or duration, shared by summaries"""
+    return TestResult(name, type, succeed)
+
+
+def submission_summary(result:SubmissionResult) -> SubmissionResult:
+    """Return the summary of given result, without source code, trace,
+    benchmarks, and tests status and duration"""
+    return SubmissionResult(tests=tuple(summary_test_result(test.name, test.type, test.succeed)
+                                        for test in result.tests),
+                            full_trace='', problem_id=result.problem_id, source_code='',
+                            grading_time=result.grading_time, cpu_time=result.cpu_time,
+                            peak_memory=result.peak_memory)
+
+
+class Compactor:
+    """Background thread applying the retention policies of problems
+    to the submissions of a storage (see storage.py).
+
+    """
+
+    def __init__(self, storage, policies:callable, interval:float=COMPACTION_INTERVAL):
+        """
+        storage -- the storage of submissions
+        policies -- callable returning an iterable of (problem id,
+                    RetentionPolicy, True if the problem is closed and exported)
+        interval -- seconds between two compactions
+
+        """
+        self.storage = storage
+        self.interval = float(interval)
+        self._policies = policies
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def compact(self) -> int:
+        """Apply the policies now, and return the number of submissions compacted"""
+        compacted = 0
+        for problem_id, policy, closed in tuple(self._policies()):
+            if closed and policy.drop_closed:
+                self.storage.drop(problem_id)
+            elif policy.full_submissions is not None:
+                nb_kept = max(1, policy.full_submissions)
+                for token in tuple(self.storage.tokens_of(problem_id)):
+                    compacted += self.storage.compact(token, problem_id, nb_kept)
+        return compacted
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.compact()
@@ -5,50 +5,211 @@ to test a user submission.
 
 import os
 import re
+import sys
+import time
+import signal
 import shutil
+import resource
+import tempfile
+import threading
+import statistics
 import subprocess
+import tracemalloc
+from io import StringIO
+from functools import partial
+from collections import namedtuple, defaultdict
+from contextlib import contextmanager, redirect_stdout
 
 import pytest
 
-from commons import TEST_TYPES, SubmissionResult, TestResult
+from commons import (TEST_TYPES, BoundedTrace, BenchmarkResult, SubmissionResult,
+                     TestResult, updated_submission_result)
 
 
-def result_from_pytest(problem, source_code, run_dir='./run/',
-                       test_output:str='./run/test_output') -> SubmissionResult:
+RUNNERS = {'subprocess', 'inprocess'}
+READY_MARKER = '.ready'  # created once tests are materialized
+MATERIALIZER_FILE = '.materializer'  # holds the pid of the materializing process
+MATERIALIZATION_TIMEOUT = 60.
+RAM_SCRATCH_ROOT = '/dev/shm'  # tmpfs on most linux systems
+REG_NODEID = re.compile(r'test_(public|hidden|community)_cases\.py::test_(.+)$')
+REG_DURATION_LINE = re.compile(r'^([0-9.]+)s +(?:setup|call|teardown) +[^ ]*test_([hiddenpubliccommunity]+)_cases\.py::test_([^ ]+)$')
+REG_RESULT_LINE = re.compile(r'^[^ ]*test_([hiddenpubliccommunity]+)_cases\.py::test_([^ ]+)(?: <- [^ ]+)? (PASSED|FAILED|TIMEOUT|MEMORY)(?: +\[ *[0-9]+%\])?$')
+OUTPUT_CHUNK_SIZE = 2 ** 16  # maximal number of characters read at once from pytest
+# conftest written in the run dir by the subprocess runner, enforcing the test
+#  timeout like ResultCollector, and giving the status of the tests failing
+#  because of a limit instead of FAILED in pytest output
+LIMITS_CONFTEST = """
+import signal
+import pytest
+
+TEST_TIMEOUT = {test_timeout!r}
+STATUSES = dict()  # nodeid: status word, when a limit was reached
+
+class GradingTimeout(BaseException):
+    pass
+
+def on_alarm(signum, frame):
+    raise GradingTimeout("Time limit reached")
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item):
+    if TEST_TIMEOUT is not None:
+        previous_handler = signal.signal(signal.SIGALRM, on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, TEST_TIMEOUT)
+    try:
+        outcome = yield
+    finally:
+        if TEST_TIMEOUT is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+    error = outcome.excinfo[1] if outcome.excinfo else None
+    if isinstance(error, GradingTimeout):
+        STATUSES[item.nodeid] = 'TIMEOUT'
+    elif isinstance(error, MemoryError):
+        STATUSES[item.nodeid] = 'MEMORY'
+
+def pytest_report_teststatus(report, config):
+    if report.when == 'call' and report.nodeid in STATUSES:
+        return 'failed', 'F', STATUSES[report.nodeid]
+"""
+
+# Limits of a grading. Times are in seconds, memory in bytes ; None for no limit.
+#  test_timeout -- wall-clock time allowed to each test
+#  submission_timeout -- wall-clock time allowed to the whole run
+#  cpu_time -- CPU time allowed to the grader process
+#  memory -- address space allowed to the grader process
+#  processes -- number of processes allowed to the user running the grader
+#  trace_size -- bytes of pytest output kept in the full trace (head and tail)
+Limits = namedtuple('Limits', 'test_timeout submission_timeout cpu_time memory'
+                    ' processes trace_size', defaults=(None,) * 6)
+NO_LIMITS = Limits()
+DEFAULT_LIMITS = Limits(test_timeout=10, submission_timeout=60, cpu_time=60,
+                        memory=2 ** 30, trace_size=2 ** 16)
+
+
+class GradingTimeout(BaseException):
+    """Raised in the grader when a time limit is reached.
+
+    Not an Exception subclass, so it can't be catched
+    by an `except Exception` in the student code.
+
+    """
+    pass
+
+
+def result_from_pytest(problem, source_code, run_dir:str or None='./run/',
+                       test_output:str='./run/test_output', *,
+                       scratch_root:str=None,
+                       runner:str='subprocess',
+                       backup:bool=True,
+                       limits:Limits=NO_LIMITS,
+                       tests_cache:str=None,
+                       dry:bool=False,
+                       priority_tests:iter=()) -> SubmissionResult:
     """Main API: return submission result knowing the problem,
     the source code and the pytest related parameters
 
+    run_dir -- directory where tests are run. If None, a unique scratch
+               directory is created under scratch_root and removed afterward,
+               allowing many jobs to run at the same time.
+    runner -- 'subprocess' to run pytest in a new process and parse its output,
+              'inprocess' to run pytest in the current process,
+              getting results directly from pytest reports. The peak memory
+              of the current process may predate the run, so it is not
+              reported (None) by the inprocess runner.
+    backup -- see populate_run_dir.
+    limits -- the Limits to enforce. Note that the inprocess runner only
+              enforces the timeouts, since the resources limits would be
+              applied to the whole running process.
+    tests_cache -- directory where tests files are materialized once
+                   per version of the problem (see materialized_tests_dir).
+                   If None, tests files are written for each run.
+    dry -- stop at the first failing test, and return the partial result.
+           Useful when only the total success matters.
+    priority_tests -- names of the tests to run before the others,
+                      typically the ones most likely to fail in a dry run.
+                      Ignored by the subprocess runner.
+
     """
-    results = run_tests_on_problem(problem, source_code, run_dir, test_output)
-    return extract_results_from_pytest_output(results, problem, source_code)
+    assert runner in RUNNERS, runner
+    if run_dir is None:
+        with isolated_run_dir(scratch_root) as run_dir:
+            return result_from_pytest(problem, source_code, run_dir,
+                                      runner=runner, backup=False, limits=limits,
+                                      tests_cache=tests_cache, dry=dry,
+                                      priority_tests=priority_tests)
+    tests_dir = materialized_tests_dir(problem, tests_cache) if tests_cache else None
+    if runner == 'inprocess':
+        populate_run_dir(problem, source_code, run_dir, backup=backup,
+                         tests_dir=tests_dir)
+        result = run_pytest_in_process(problem, source_code, run_dir, limits,
+                                       dry=dry, priority_tests=priority_tests)
+        return updated_submission_result(result, peak_memory=None)
+    result, status = run_tests_on_problem(problem, source_code, run_dir, test_output,
+                                          backup=backup, limits=limits,
+                                          tests_dir=tests_dir, dry=dry)
+    if status:  # the run was interrupted
+        result = with_missing_tests(result, problem, status)
+    return result
 
 
-def run_tests_on_problem(problem, source_code, run_dir='./run/',
-                         test_output:str='./run/test_output'):
-    """Run problem specs on given source code, in given run_dir.
+def ram_scratch_root() -> str or None:
+    """Return RAM_SCRATCH_ROOT if it is usable, else None, meaning
+    the system temporary directory.
 
-    WARNING: Will erase everything found in run_dir.
+    """
+    if os.path.isdir(RAM_SCRATCH_ROOT) and os.access(RAM_SCRATCH_ROOT, os.W_OK):
+        return RAM_SCRATCH_ROOT
+    return None
 
-    Return the tests results (raw lines returned by pytest).
 
-    This method is interesting, but go out of python.
-    Could be an advantage when passing by apparmor or other sandboxing modes.
+@contextmanager
+def isolated_run_dir(scratch_root:str=None) -> str:
+    """Yield path to a new unique directory, removed at exit"""
+    run_dir = tempfile.mkdtemp(prefix='weldon-run-', dir=scratch_root)
+    try:
+        yield run_dir
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def populate_run_dir(problem, source_code, run_dir='./run/', *, backup:bool=True,
+                     tests_dir:str=None):
+    """Write source code and tests files of given problem in given run_dir.
+
+    WARNING: Will erase everything found in run_dir, unless backup is False,
+    in which case run_dir is expected to be a dedicated (and empty) directory.
+
+    tests_dir -- directory of already materialized tests files, that will be
+                 copied into run_dir instead of being written again
+                 (see materialized_tests_dir).
+
     """
-    # first backup and empty the run dir
-    backup_dir = run_dir.rstrip('/') + '.backup'
-    if os.path.exists(backup_dir):
-        shutil.rmtree(backup_dir)
-    if os.path.exists(run_dir):
-        shutil.move(run_dir, backup_dir)
-    os.mkdir(run_dir)
+    if backup:
+        # first backup and empty the run dir
+        backup_dir = run_dir.rstrip('/') + '.backup'
+        if os.path.exists(backup_dir):
+            shutil.rmtree(backup_dir)
+        if os.path.exists(run_dir):
+            shutil.move(run_dir, backup_dir)
+        os.mkdir(run_dir)
+    else:
+        os.makedirs(run_dir, exist_ok=True)
 
     # populate the run dir
-    runnable_source_code_file = problem.source_code_filename(dir=run_dir)
+    if tests_dir:
+        copy_tree(tests_dir, run_dir)
+    else:
+        write_test_files(problem, run_dir)
+    with open(problem.source_code_filename(dir=run_dir), 'w') as fd:
+        fd.write(source_code)
+
+
+def write_test_files(problem, run_dir:str):
+    """Write the tests files of given problem in given directory"""
     runnable_public_test_file = problem.public_test_filename(dir=run_dir)
     runnable_hidden_test_file = problem.hidden_test_filename(dir=run_dir)
     runnable_community_test_file = problem.community_test_filename(dir=run_dir)
-    with open(runnable_source_code_file, 'w') as fd:
-        fd.write(source_code)
     with open(runnable_public_test_file, 'w') as fd:
         fd.write('import pytest\n')
         fd.write('from {} import *\n\n'.format(problem.source_name))
@@ -61,22 +222,593 @@ def run_tests_on_problem(problem, source_code, run_dir='./run/',
         fd.write('import pytest\n')
         fd.write('from {} import *\n\n'.format(problem.source_name))
         fd.write('\n'.join(map(str, problem.community_tests)))
+
+
+def materialization_dir(problem, tests_cache:str) -> str:
+    """Return the directory, in given tests_cache, where the tests files
+    of the current version of given problem are materialized"""
+    return os.path.join(tests_cache, 'problem{}-{}'.format(
+        problem.id, problem.test_suite_hash))
+
+
+def materialized_tests_dir(problem, tests_cache:str) -> str:
+    """Return the directory, in given tests_cache, holding the tests files
+    of the current version of given problem, along with their bytecode.
+
+    The directory is created if needed. Many processes can ask for it
+    at the same time: the first one materializes it, the others wait
+    for its ready marker. A directory left unready by a failing or dead
+    process (or after MATERIALIZATION_TIMEOUT) is removed,
+    and materialized again.
+    Note that the bytecode keeps the path of this directory,
+    so tracebacks will refer to its tests files.
+
+    """
+    tests_dir = materialization_dir(problem, tests_cache)
+    ready_marker = os.path.join(tests_dir, READY_MARKER)
+    while True:
+        # the directory is claimed with the pid of its materializer already in
+        claim = tempfile.mkdtemp(prefix='.claim-', dir=tests_cache)
+        with open(os.path.join(claim, MATERIALIZER_FILE), 'w') as fd:
+            fd.write(str(os.getpid()))
+        try:
+            os.rename(claim, tests_dir)
+            break
+        except OSError:  # materialized, or being materialized
+            shutil.rmtree(claim, ignore_errors=True)
+            if not os.path.isdir(tests_dir):
+                raise
+            deadline = time.monotonic() + MATERIALIZATION_TIMEOUT
+            while (not os.path.exists(ready_marker) and time.monotonic() < deadline
+                   and os.path.isdir(tests_dir) and materializer_alive(tests_dir)):
+                time.sleep(0.01)
+            if os.path.exists(ready_marker):
+                return tests_dir
+            discard_tree(tests_dir, tests_cache)  # materializer died
+    try:
+        write_test_files(problem, tests_dir)
+        # the student module is needed to import the tests
+        with open(problem.source_code_filename(dir=tests_dir), 'w') as fd:
+            fd.write('')
+        precompile_tests(problem, tests_dir)
+        os.remove(problem.source_code_filename(dir=tests_dir))
+        with open(ready_marker, 'w'):
+            pass
+    except BaseException:
+        discard_tree(tests_dir, tests_cache)
+        raise
+    return tests_dir
+
+
+def materializer_alive(tests_dir:str) -> bool:
+    """False if the process materializing given directory is known dead"""
+    try:
+        with open(os.path.join(tests_dir, MATERIALIZER_FILE)) as fd:
+            os.kill(int(fd.read()), 0)
+    except (FileNotFoundError, ValueError):  # not a directory claimed by a process
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError:  # exists, but owned by someone else
+        return True
+    return True
+
+
+def discard_tree(directory:str, parent_dir:str):
+    """Atomically remove given directory from its place, then delete it.
+    Nothing is done if it was already removed (by another process)."""
+    trash = tempfile.mkdtemp(prefix='.discarded-', dir=parent_dir)
+    try:
+        os.rename(directory, os.path.join(trash, 'tree'))
+    except FileNotFoundError:
+        pass
+    shutil.rmtree(trash, ignore_errors=True)
+
+
+def copy_tree(source_dir:str, target_dir:str):
+    """Copy all files of source_dir into target_dir. Files modification
+    times are kept, so compiled modules remain valid.
+
+    Files are never linked: the copies are given to untrusted code,
+    that must not be able to modify the source files.
+
+    """
+    for dirpath, _, filenames in os.walk(source_dir):
+        target_subdir = os.path.join(target_dir, os.path.relpath(dirpath, source_dir))
+        os.makedirs(target_subdir, exist_ok=True)
+        for filename in filenames:
+            if filename in {READY_MARKER, MATERIALIZER_FILE}:
+                continue
+            source = os.path.join(dirpath, filename)
+            shutil.copy2(source, os.path.join(target_subdir, filename))
+
+
+def run_tests_on_problem(problem, source_code, run_dir='./run/',
+                         test_output:str='./run/test_output', *,
+                         backup:bool=True, limits:Limits=NO_LIMITS,
+                         tests_dir:str=None, dry:bool=False) -> (SubmissionResult, str or None):
+    """Run problem specs on given source code, in given run_dir.
+
+    WARNING: Will erase everything found in run_dir, unless backup is False
+    (see populate_run_dir, also for tests_dir).
+    If dry, pytest stops at the first failing test.
+
+    Return the SubmissionResult, built from pytest output as it is streamed,
+    and the status of the tests that did not run because pytest
+    was interrupted by a limit ('timeout' or 'memory'), or None.
+    The test timeout is enforced by a conftest written in run_dir
+    (see LIMITS_CONFTEST), that also reports the tests failing
+    because of a limit.
+    Only the head and the tail of the output are kept in the trace
+    (see Limits.trace_size).
+
+    This method is interesting, but go out of python.
+    Could be an advantage when passing by apparmor or other sandboxing modes.
+    """
+    populate_run_dir(problem, source_code, run_dir, backup=backup,
+                     tests_dir=tests_dir)
+    with open(os.path.join(run_dir, 'conftest.py'), 'w') as fd:
+        fd.write(LIMITS_CONFTEST.format(test_timeout=limits.test_timeout))
     # run the tests
-    proc = subprocess.Popen(['pytest', run_dir, '-vv'], stdout=subprocess.PIPE)
-    stdout, stderr = proc.communicate()
-    return stdout.decode()
+    start = time.monotonic()
+    proc = subprocess.Popen(['pytest'] + pytest_arguments(run_dir, *run_options(dry),
+                                                          '--durations=0'),
+                            stdout=subprocess.PIPE, text=True, errors='replace',
+                            env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'),
+                            preexec_fn=partial(apply_rlimits, limits))
+    timed_out = threading.Event()
+    def kill():
+        timed_out.set()
+        proc.kill()
+    timer = None
+    if limits.submission_timeout is not None:
+        timer = threading.Timer(limits.submission_timeout, kill)
+        timer.start()
+    tests, trace = [], BoundedTrace(limits.trace_size)
+    durations = defaultdict(float)  # (type, name): duration of all phases
+    try:
+        # lines longer than a chunk are read in many parts, that are not results
+        for line in iter(partial(proc.stdout.readline, OUTPUT_CHUNK_SIZE), ''):
+            trace.write(line)
+            line = line.rstrip('\n')
+            test = result_from_pytest_line(line)
+            if test:
+                tests.append(test)
+            match = REG_DURATION_LINE.match(line)
+            if match:
+                duration, type, name = match.groups()
+                durations[type, name] += float(duration)
+        # wait4 gives the resources used by the grader
+        _, exit_status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(exit_status)
+    finally:
+        if timer:
+            timer.cancel()
+        proc.stdout.close()
+    tests = [TestResult(test.name, test.type, test.succeed, test.status,
+                        durations.get((test.type, test.name)))
+             for test in tests]
+    result = SubmissionResult(tests=tests, full_trace=trace.getvalue(),
+                              problem_id=problem.id, source_code=str(source_code))
+    result = with_resources_usage(result, time.monotonic() - start, usage)
+    if not dry:
+        result = updated_submission_result(result, benchmarks=run_benchmarks_in_subprocess(
+            problem, run_dir, limits))
+    if timed_out.is_set():
+        return result, 'timeout'
+    return result, status_of_killed_grader(proc.returncode)
+
+
+def pytest_arguments(run_dir:str, *options:str) -> [str]:
+    """Return the command line arguments of pytest for a run in given run_dir.
+
+    Nothing is looked for or written outside of run_dir,
+    and the cache provider is disabled since each run dir is used once.
+
+    """
+    return [run_dir, *(options or ('-vv',)), '--rootdir', run_dir,
+            '--confcutdir', run_dir, '-p', 'no:cacheprovider']
+
+
+def with_resources_usage(result:SubmissionResult, grading_time:float, usage,
+                         usage_before=None) -> SubmissionResult:
+    """Return given result with given grading time, and the CPU time and
+    peak memory found in given resource.struct_rusage of the grader.
+    CPU time of usage_before, if given, is not counted. The peak memory
+    can't be made relative: it is the one of the whole life of the grader.
+
+    """
+    cpu_time = usage.ru_utime + usage.ru_stime
+    if usage_before is not None:
+        cpu_time -= usage_before.ru_utime + usage_before.ru_stime
+    return updated_submission_result(result, grading_time=grading_time,
+                                     cpu_time=cpu_time,
+                                     peak_memory=usage.ru_maxrss * 1024)  # kilobytes on linux
+
+
+def run_options(dry:bool=False) -> (str,):
+    """Return the pytest options of a run, stopping at first failure if dry"""
+    return ('-vv', '-x') if dry else ('-vv',)
+
+
+def apply_rlimits(limits:Limits):
+    """Apply to the current process the resources limits found in given Limits"""
+    for rlimit, value in ((resource.RLIMIT_CPU, limits.cpu_time),
+                          (resource.RLIMIT_AS, limits.memory),
+                          (resource.RLIMIT_NPROC, limits.processes)):
+        if value is not None:
+            _, hard = resource.getrlimit(rlimit)
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.setrlimit(rlimit, (int(value), hard))
+
+
+def status_of_killed_grader(returncode:int) -> str or None:
+    """Return the status of the tests that a grader process, ended
+    with given return code, could not run ; None if it was not killed.
+
+    """
+    if returncode in {-signal.SIGXCPU, -signal.SIGKILL}:
+        return 'timeout'  # killed by a CPU limit, or because too long
+    if returncode is not None and returncode < 0:
+        return 'error'
+    return None
+
+
+def with_missing_tests(result:SubmissionResult, problem, status:str) -> SubmissionResult:
+    """Return given result, completed with the tests and benchmarks
+    of problem that have no result, with given status.
+
+    """
+    tests = list(result.tests)
+    tests.extend(_missing_results(problem, tests, status))
+    benchmarks = list(result.benchmarks)
+    known = {bench.name for bench in benchmarks}
+    benchmarks.extend(BenchmarkResult(bench.name, False, status)
+                      for bench in problem.benchmarks if bench.name not in known)
+    return updated_submission_result(result, tests=tests, benchmarks=benchmarks)
+
+
+def _missing_results(problem, results:[TestResult], status:str,
+                     types:iter=TEST_TYPES) -> iter:
+    """Yield a failed TestResult of given status for each test of problem
+    of given types that have no result in given results.
+
+    """
+    known = {(test.type, test.name) for test in results}
+    for test in problem.tests:
+        name = test.name[len('test_'):]
+        if test.type in types and (test.type, name) not in known:
+            yield TestResult(name, test.type, False, status, 0.)
+
+
+class ResultCollector:
+    """Pytest plugin building the TestResult instances of a run
+    from the pytest reports, without any parsing of pytest output.
+
+    """
+
+    def __init__(self, problem, limits:Limits=NO_LIMITS, priority_tests:iter=()):
+        self.problem = problem
+        self.limits = limits
+        self.priority_tests = frozenset(priority_tests)
+        self._results = {}  # nodeid: TestResult, in running order
+        self._broken_types = {}  # type of test whose module is not importable: status
+        self._statuses = {}  # nodeid: status, when a limit was reached
+        self._deadline = None
+        if limits.submission_timeout is not None:
+            self._deadline = time.monotonic() + limits.submission_timeout
+
+    def pytest_collection_modifyitems(self, items):
+        if self.priority_tests:  # stable sort: other tests keep their order
+            items.sort(key=lambda item: item.originalname not in self.priority_tests)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        with self._time_limit(self.limits.test_timeout):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_make_collect_report(self, collector):
+        with self._time_limit():  # test modules imports student code
+            yield
+
+    def pytest_exception_interact(self, node, call, report):
+        if call.excinfo.errisinstance(GradingTimeout):
+            self._statuses[report.nodeid] = 'timeout'
+        elif call.excinfo.errisinstance(MemoryError):
+            self._statuses[report.nodeid] = 'memory'
+
+    def _time_limit(self, timeout:float=None):
+        """Context raising GradingTimeout when given timeout, or the time
+        remaining for the submission, is reached (see time_limit).
+
+        """
+        if self._deadline is not None:
+            remaining = self._deadline - time.monotonic()
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return time_limit(timeout)
+
+    def pytest_runtest_logreport(self, report):
+        match = REG_NODEID.search(report.nodeid)
+        if not match:  # not a test of the problem
+            return
+        type, testname = match.groups()
+        previous = self._results.get(report.nodeid)
+        status = previous.status if previous else None
+        duration = (previous.duration if previous else 0.) + report.duration
+        if report.when == 'call':
+            status = 'passed' if report.passed else ('skipped' if report.skipped else 'failed')
+        elif report.failed:  # setup or teardown failed
+            status = 'error'
+        elif report.skipped:  # skipped during setup
+            status = 'skipped'
+        if status in {'failed', 'error'}:
+            status = self._statuses.get(report.nodeid, status)
+        self._results[report.nodeid] = TestResult(testname, type, status == 'passed',
+                                                  status, duration)
+
+    def pytest_collectreport(self, report):
+        if report.failed:  # test module is not importable (e.g. bad student code)
+            match = re.search(r'test_(public|hidden|community)_cases\.py$', report.nodeid)
+            if match:
+                status = self._statuses.get(report.nodeid, 'error')
+                self._broken_types[match.group(1)] = status
+
+    @property
+    def tests(self) -> [TestResult]:
+        """All test results ; tests of modules that could not be imported
+        are reported as errors (or timeout, or memory if a limit was reached).
+
+        """
+        tests = list(self._results.values())
+        for type, status in self._broken_types.items():
+            tests.extend(_missing_results(self.problem, tests, status, types={type}))
+        return tests
+
+
+@contextmanager
+def time_limit(timeout:float=None):
+    """Context raising GradingTimeout when given timeout is reached.
+
+    Only the main thread can receive signals, so no limit is enforced
+    when running in another thread.
+
+    """
+    if timeout is None or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    def on_alarm(signum, frame):
+        raise GradingTimeout("Time limit reached")
+    previous_handler = signal.signal(signal.SIGALRM, on_alarm)
+    # an elapsed timeout must still interrupt the code quickly
+    signal.setitimer(signal.ITIMER_REAL, max(timeout, 0.001))
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def run_pytest_in_process(problem, source_code:str, run_dir:str,
+                          limits:Limits=NO_LIMITS, *, dry:bool=False,
+                          priority_tests:iter=()) -> SubmissionResult:
+    """Run pytest inside the current process on given (already populated)
+    run_dir, and return the SubmissionResult built by a ResultCollector.
+    See result_from_pytest for dry and priority_tests.
+
+    Time limits of given Limits are enforced ; the resources limits
+    are expected to be already applied to the process.
+    The benchmarks of the problem are run after the tests, unless dry.
+    The resources used by the process during the run are measured
+    (see with_resources_usage) ; the peak memory is the one of the whole
+    life of the process, so it is the one of the run only in a process
+    dedicated to it, like a child of a zygote.
+
+    Modules imported by the run (student module and tests) are forgotten
+    afterward, so the same process can grade another submission.
+
+    """
+    collector = ResultCollector(problem, limits, priority_tests)
+    output = BoundedTrace(limits.trace_size)
+    run_dir = os.path.abspath(run_dir)
+    # tests bytecode is materialized, and student one is used only once
+    dont_write_bytecode, sys.dont_write_bytecode = sys.dont_write_bytecode, True
+    start, usage_before = time.monotonic(), resource.getrusage(resource.RUSAGE_SELF)
+    try:
+        with forgotten_imports(run_dir), redirect_stdout(output):
+            pytest.main(pytest_arguments(run_dir, *run_options(dry)),
+                        plugins=[collector])
+        benchmarks = () if dry else run_benchmarks(problem, run_dir, limits)
+    finally:
+        sys.dont_write_bytecode = dont_write_bytecode
+    result = SubmissionResult(tests=collector.tests, full_trace=output.getvalue(),
+                              problem_id=problem.id, source_code=str(source_code),
+                              benchmarks=benchmarks)
+    return with_resources_usage(result, time.monotonic() - start,
+                                resource.getrusage(resource.RUSAGE_SELF), usage_before)
+
+
+def run_benchmarks(problem, run_dir:str, limits:Limits=NO_LIMITS) -> [BenchmarkResult]:
+    """Run the benchmarks of given problem in the current process,
+    on the student module found in given (populated) run_dir.
+
+    Each benchmark run is limited by the test timeout of given limits.
+    Student module is forgotten afterward, and its output is discarded.
+
+    """
+    if not problem.benchmarks:
+        return []
+    run_dir = os.path.abspath(run_dir)
+    with forgotten_imports(run_dir), open(os.devnull, 'w') as devnull, \
+            redirect_stdout(devnull):
+        sys.path.insert(0, run_dir)
+        return [run_benchmark(benchmark, problem.source_name, limits)
+                for benchmark in problem.benchmarks]
+
+
+def run_benchmark(benchmark, source_name:str, limits:Limits=NO_LIMITS) -> BenchmarkResult:
+    """Return the result of given Benchmark on the student module of given
+    name, that must be importable.
+
+    The benchmark function is run benchmark.repeat times at each scale
+    to get the median timings, then, if the benchmark has a memory budget
+    and is not already too slow, once more at the largest scale to get
+    the peak memory allocation (tracing allocations is slow).
+
+    """
+    timings, peak_memory = [], None
+    try:
+        with time_limit(limits.test_timeout):
+            namespace = {}
+            code = 'from {} import *\n'.format(source_name) + benchmark.source_code
+            exec(compile(code, '<{}>'.format(benchmark.name), 'exec'), namespace)
+            function = namespace[benchmark.name]
+            for scale in benchmark.scales:
+                durations = []
+                for _ in range(benchmark.repeat):
+                    start = time.perf_counter()
+                    function(scale)
+                    durations.append(time.perf_counter() - start)
+                timings.append((scale, statistics.median(durations)))
+            if benchmark.memory_budget is not None and timings[-1][1] <= benchmark.time_budget:
+                tracemalloc.start()
+                try:
+                    function(benchmark.largest_scale)
+                    _, peak_memory = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+    except GradingTimeout:
+        status = 'timeout'
+    except MemoryError:
+        status = 'memory'
+    except Exception:
+        status = 'error'
+    else:
+        if timings[-1][1] > benchmark.time_budget:
+            status = 'slow'
+        elif peak_memory is not None and peak_memory > benchmark.memory_budget:
+            status = 'memory'
+        else:
+            status = 'passed'
+    return BenchmarkResult(benchmark.name, status == 'passed', status,
+                           tuple(timings), peak_memory)
+
+
+def run_benchmarks_in_subprocess(problem, run_dir:str,
+                                 limits:Limits=NO_LIMITS) -> [BenchmarkResult]:
+    """Run the benchmarks of given problem in a new process,
+    on the student module found in given (populated) run_dir.
+
+    Benchmarks that did not give a result, because the process was killed,
+    are reported with the status of the killed process.
+    Results are written in a new file outside run_dir, where the student
+    module is free to write.
+
+    """
+    import wjson  # only needed by this runner
+    if not problem.benchmarks:
+        return []
+    fd, results_file = tempfile.mkstemp(prefix='weldon-benchmarks-', suffix='.json')
+    os.close(fd)
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1',
+               PYTHONPATH=os.pathsep.join(filter(None, (package_dir, os.environ.get('PYTHONPATH')))))
+    payload = wjson.as_json({'source_name': problem.source_name, 'limits': list(limits),
+                             'benchmarks': problem.benchmarks})
+    try:
+        proc = subprocess.Popen([sys.executable, '-m', 'run_pytest', run_dir, results_file],
+                                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, env=env,
+                                preexec_fn=partial(apply_rlimits, limits))
+        try:
+            proc.communicate(payload.encode(), timeout=limits.submission_timeout)
+            status = status_of_killed_grader(proc.returncode)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            status = 'timeout'
+        with open(results_file) as fd:
+            results = fd.read()
+    finally:
+        os.remove(results_file)
+    results = wjson.from_json(results) if results else []
+    known = {result.name for result in results}
+    results.extend(BenchmarkResult(bench.name, False, status or 'error')
+                   for bench in problem.benchmarks if bench.name not in known)
+    return results
+
+
+def precompile_tests(problem, run_dir:str):
+    """Make pytest collect the tests found in given (populated) run_dir,
+    so the test modules are rewritten and compiled in its __pycache__.
+
+    The compiled student module is removed, since it is not part
+    of the tests.
+
+    """
+    run_dir = os.path.abspath(run_dir)
+    dont_write_bytecode, sys.dont_write_bytecode = sys.dont_write_bytecode, False
+    try:
+        with forgotten_imports(run_dir), redirect_stdout(StringIO()):
+            pytest.main(pytest_arguments(run_dir, '--collect-only', '-q'))
+    finally:
+        sys.dont_write_bytecode = dont_write_bytecode
+    cache_dir = os.path.join(run_dir, '__pycache__')
+    for filename in os.listdir(cache_dir) if os.path.isdir(cache_dir) else ():
+        if filename.startswith(problem.source_name + '.'):
+            os.remove(os.path.join(cache_dir, filename))
+
+
+@contextmanager
+def forgotten_imports(run_dir:str):
+    """Context where modules imported from given run_dir, and the changes
+    of sys.path, are forgotten at exit.
+
+    """
+    path_before = list(sys.path)
+    try:
+        yield
+    finally:
+        for name, module in tuple(sys.modules.items()):
+            if (getattr(module, '__file__', None) or '').startswith(run_dir):
+                del sys.modules[name]
+        sys.path[:] = path_before
 
 
 def extract_results_from_pytest_output(output:str, problem,
                                        source_code:str) -> SubmissionResult:
     """Return a SubmissionResult instance describing given pytest output"""
-    reg_test = re.compile(r'^[\/a-zA-Z_0-9]+test_([hiddenpubliccommunity]+)_cases\.py::test_([a-zA-Z_0-9]+) ([PASSEDFAIL]+)$')
     tests = []  # all Test instances
     for line in output.splitlines(keepends=False):
-        match = reg_test.match(line)
-        if match:
-            type, testname, result = match.groups()
-            assert type in TEST_TYPES
-            tests.append(TestResult(testname, type, result == 'PASSED'))
+        test = result_from_pytest_line(line)
+        if test:
+            tests.append(test)
     return SubmissionResult(tests=tests, full_trace=str(output),
                             problem_id=problem.id, source_code=str(source_code))
+
+
+def result_from_pytest_line(line:str) -> TestResult or None:
+    """Return the TestResult described by given line of pytest output,
+    or None if the line is not a test result.
+
+    """
+    match = REG_RESULT_LINE.match(line)
+    if match:
+        type, testname, result = match.groups()
+        assert type in TEST_TYPES
+        return TestResult(testname, type, result == 'PASSED', result.lower())
+    return None
+
+
+if __name__ == '__main__':
+    # benchmarks runner of run_benchmarks_in_subprocess:
+    #  benchmarks and limits are read on stdin, results written in given file
+    import wjson
+    run_dir, results_file = sys.argv[1:]
+    data = wjson.from_json(sys.stdin.read())
+    problem = namedtuple('BenchmarkedProblem', 'source_name benchmarks')(
+        data['source_name'], tuple(data['benchmarks']))
+    results = run_benchmarks(problem, run_dir, Limits(*data['limits']))
+    with open(results_file, 'w') as fd:
+        fd.write(wjson.as_json(results))
@@ -8,15 +8,25 @@ import re
 import uuid
 import base64
 import inspect
+import threading
 import functools
 from json import JSONDecodeError
+from concurrent.futures import Future
 from collections import defaultdict, namedtuple
 
 import wjson
 from wtest import Test
-from commons import SubmissionResult, ServerError
+from commons import SubmissionResult, ServerError, merge_submission_results
 from problem import Problem
-from run_pytest import result_from_pytest
+from benchmark import Benchmark
+from grading import GradingPool, DEFAULT_RUNNER, DEFAULT_SHARDING_THRESHOLD
+from run_pytest import DEFAULT_LIMITS, Limits
+from grading_cache import GradingCache, DEFAULT_CACHE_SIZE
+from regrading import Regrading
+from grading_queue import GradingQueue
+from storage import MemoryStorage, SQLiteStorage
+from journal import Journal, SNAPSHOT_INTERVAL
+from retention import Compactor, RetentionPolicy, KEEP_ALL, COMPACTION_INTERVAL
 from player_report import make_report_on_player
 from hybrid_encryption import HybridEncryption
 
@@ -30,6 +40,13 @@ NAME_MAIL_VALIDER = (
 )
 ERROR_PAYLOAD = '{{"status":"failed","encryption_key":null,"payload":"{}"}}'
 
+# entry of the dispatch table of the Server API, for a method:
+#  method -- the bound method
+#  need_token -- True if the first parameter is the token of the caller
+#  rooter_only -- True if only rooters can call it
+#  parameters -- names of the parameters
+ApiMethod = namedtuple('ApiMethod', 'method need_token rooter_only parameters')
+
 
 def api_method(func:callable) -> callable:
     """Decorator around method callable by Server API.
@@ -47,7 +64,7 @@ def api_method(func:callable) -> callable:
         # method is wrapped to automatically provide token validation
         @functools.wraps(func)
         def decorator(self, token, *args, **kwargs):
-            self._validate_token(token, getattr(self, func.__name__))
+            self._validate_token(token, func.__name__)
             return func(self, token, *args, **kwargs)
         decorator.need_token = True
     else:  # method is not wrapped
@@ -62,10 +79,41 @@ class Server:
 
     def __init__(self, player_password='', rooter_password='',
                  player_name_valider:(callable, str)=DEFAULT_VALIDER,
-                 rooter_name_valider:(callable, str)=DEFAULT_VALIDER):
+                 rooter_name_valider:(callable, str)=DEFAULT_VALIDER,
+                 grading_workers:int=None, grading_runner:str=DEFAULT_RUNNER,
+                 grading_limits:Limits=DEFAULT_LIMITS,
+                 grading_scratch_root:str=None,
+                 grading_sharding_threshold:int=DEFAULT_SHARDING_THRESHOLD,
+                 grading_cache_size:int=DEFAULT_CACHE_SIZE,
+                 database:str=None, journal:str=None,
+                 snapshot_interval:int=SNAPSHOT_INTERVAL,
+                 retention_policy:RetentionPolicy=KEEP_ALL,
+                 compaction_interval:float=COMPACTION_INTERVAL):
         """
         password -- the password expected to register.
         name_valider -- map name to boolean. If true, registration is accepted.
+        grading_workers -- number of submissions tested in parallel
+                           (default: number of cores).
+        grading_runner -- how pytest is run (see grading.RUNNERS).
+        grading_limits -- time and resources limits of a grading
+                          (see run_pytest.Limits).
+        grading_scratch_root -- directory where gradings are run ; a RAM-backed
+                                one (like /dev/shm) is used by default if any.
+        grading_sharding_threshold -- number of tests from which the tests of
+                                      a submission are split among workers.
+        grading_cache_size -- number of grading results kept in cache,
+                              so that resubmitted codes are not tested again.
+        database -- path to the SQLite database where submissions are stored
+                    (see storage.py). If None, they are kept in memory only.
+        journal -- directory where changes of the server state are journaled
+                   (see journal.py), so a restarted server recovers its state.
+                   If None, the state is lost when the server stops.
+        snapshot_interval -- number of journaled changes between two
+                             snapshots of the whole state.
+        retention_policy -- how long submissions are kept, for problems
+                            without their own policy (see retention.py).
+        compaction_interval -- seconds between two applications of the
+                               retention policies.
 
         The name valider is here to enforce players or rooters to adopt a
         particular naming scheme, that could be anything, like an email adress
@@ -85,33 +133,186 @@ class Server:
         self.restricted_to_rooter = {self.register_problem,
                                      self.add_hidden_test, self.add_public_test,
                                      self.close_problem_session,
-                                     self.retrieve_players_of}
-        self._db = defaultdict(lambda: defaultdict(list))  # token: {problem_id: [data]}
+                                     self.retrieve_players_of,
+                                     self.retrieve_submissions,
+                                     self.set_retention_policy,
+                                     self.retrieve_grading_stats,
+                                     self.retrieve_regrading_status}
+        self._api = self._api_dispatch_table()  # name: ApiMethod
+        self._api_parameters = self.api_methods_parameters()
+        self._player_api_parameters = {name: params for name, params
+                                       in self._api_parameters.items()
+                                       if not self._api[name].rooter_only}
+        self._db = SQLiteStorage(database) if database else MemoryStorage()
         self._players_name = {}  # token: name
         self._players_encryption_key = defaultdict(lambda: None)  # token: public key
         self._players_from_name = {}  # name: token
+        self._test_authors = defaultdict(dict)  # problem id: {token of community tests author: None}
+        self._tested_problems = defaultdict(dict)  # token: {id of problem it sent tests to: None}
         self._encryption_keypair = HybridEncryption()
+        self._grading_pool = GradingPool(grading_workers, grading_scratch_root,
+                                         runner=grading_runner,
+                                         limits=grading_limits,
+                                         sharding_threshold=grading_sharding_threshold)
+        self._grading_cache = GradingCache(grading_cache_size)
+        self._regradings = {}  # problem id: last Regrading launched
+        self._grading_queue = GradingQueue(self._run_tests_for_player,
+                                           nb_workers=self._grading_pool.nb_workers)
+        self._retention_policy = RetentionPolicy(*retention_policy)
+        self._retention_policies = {}  # problem id: RetentionPolicy, if not the default
+        self._exported_problems = set()  # id of problems whose submissions were retrieved
+        self._compactor = Compactor(self._db, self._retention_targets, compaction_interval)
+        self._state_lock = threading.RLock()  # changes are journaled in order
+        self._snapshot_lock = threading.Lock()
+        self._journal = Journal(journal, snapshot_interval) if journal else None
+        if self._journal:
+            self._recover()
+
+    def close(self):
+        """Stop the grading workers and write the pending submissions,
+        and a last snapshot of the state if journaled"""
+        self._grading_pool.shutdown()
+        self._compactor.stop()
+        if self._journal:
+            self.snapshot()
+            self._journal.close()
+        self._db.close()
+
+
+    def _record(self, event:str, *args):
+        """Apply given event to the server state by calling the _apply_<event>
+        method, and journal it before returning"""
+        with self._state_lock:
+            getattr(self, '_apply_' + event)(*args)
+            if not self._journal:
+                return
+            seq = self._journal.append(event, *args)
+            snapshot = self._journal.snapshot_needed and not self._snapshot_lock.locked()
+        self._journal.wait(seq)
+        if snapshot:  # in background, so the caller do not wait for it
+            threading.Thread(target=self.snapshot, daemon=True).start()
+
+    def snapshot(self):
+        """Write a snapshot of the whole state in the journal, so the events
+        before it will not be replayed at restart"""
+        with self._snapshot_lock:
+            with self._state_lock:
+                state, seq = self._state(), self._journal.rotate()
+            self._journal.write_snapshot(state, seq)
+
+    def _state(self) -> dict:
+        """Return a copy of the state, as written in snapshots"""
+        return {
+            'next_problem_id': self._next_problem_id,
+            'problems': list(self.problems_by_id.values()),  # immutable
+            'open_problems': sorted(self.open_problems),
+            'retention_policies': [[problem_id, *policy] for problem_id, policy
+                                   in self._retention_policies.items()],
+            'exported_problems': sorted(self._exported_problems),
+            'players': [[token, name, token in self.tokens_rooter,
+                         self._encoded_public_key(token)]
+                        for token, name in self._players_name.items()],
+            # the SQLite database already keeps the submissions
+            'submissions': [] if self._db.persistent else list(self._db.all_submissions()),
+        }
+
+    def _recover(self):
+        """Restore the state from the last snapshot and the journal"""
+        state, events = self._journal.recover()
+        if state:
+            for player in state['players']:
+                self._apply_player(*player)
+            for problem in state['problems']:
+                self._apply_problem(problem)
+            self.open_problems = set(state['open_problems'])
+            for policy in state.get('retention_policies', ()):
+                self._apply_retention(*policy)
+            self._exported_problems = set(state.get('exported_problems', ()))
+            self._next_problem_id = state['next_problem_id']
+            for token, result in state['submissions']:
+                self._apply_submission(token, result)
+        for event, *args in events:
+            getattr(self, '_apply_' + event)(*args)
+
+    def _encoded_public_key(self, token:str) -> str or None:
+        public_key = self._players_encryption_key.get(token)
+        return base64.b64encode(public_key).decode() if public_key else None
+
+    def _apply_player(self, token:str, name:str, root:bool, public_key:str or None):
+        (self.tokens_rooter if root else self.tokens_player).add(token)
+        self._players_name[token] = name
+        self._players_from_name[name] = token
+        self._players_encryption_key[token] = base64.b64decode(public_key) if public_key else None
+        self._db.add_player(token, name, root)
+
+    def _apply_problem(self, problem:Problem):
+        self.problems_by_id[problem.id] = problem
+        self.problems[problem.title] = problem
+        self.open_problems.add(problem.id)
+        self._next_problem_id = max(self._next_problem_id, problem.id + 1)
+        for test in problem.community_tests:
+            self._index_test_author(problem.id, test)
+        self._db.add_problem(problem)
+
+    def _apply_test(self, problem_id:int, test:Test):
+        problem = self.problems_by_id[problem_id].with_test(test)
+        self.problems_by_id[problem.id] = problem
+        self.problems[problem.title] = problem
+        if test.type == 'community':
+            self._index_test_author(problem_id, test)
+        self._db.add_test(problem_id, test)
+
+    def _index_test_author(self, problem_id:int, test:Test):
+        token = self._players_from_name.get(test.author)
+        if token is not None:
+            self._test_authors[problem_id][token] = None
+            self._tested_problems[token][problem_id] = None
+
+    def _apply_session(self, problem_id:int, open:bool):
+        if open:
+            self.open_problems.add(problem_id)
+            self._exported_problems.discard(problem_id)  # new submissions to come
+        else:
+            self.open_problems.discard(problem_id)
+
+    def _apply_retention(self, problem_id:int, full_submissions:int or None,
+                         drop_closed:bool):
+        self._retention_policies[problem_id] = RetentionPolicy(full_submissions, drop_closed)
+
+    def _apply_export(self, problem_id:int, exported:bool=True):
+        if exported:
+            self._exported_problems.add(problem_id)
+        else:
+            self._exported_problems.discard(problem_id)
+
+    def _apply_submission(self, token:str, result:SubmissionResult):
+        self._exported_problems.discard(result.problem_id)  # not retrieved yet
+        self._db.add_submission(token, result)
+
+    def _api_dispatch_table(self) -> {str: ApiMethod}:
+        """Return map of methods of server that belongs to the API
+        with their ApiMethod"""
+        restricted = {func.__name__ for func in self.restricted_to_rooter}
+        return {
+            name: ApiMethod(getattr(self, name), func.need_token, name in restricted,
+                            tuple(inspect.signature(getattr(self, name)).parameters.keys()))
+            for name, func in inspect.getmembers(type(self), predicate=inspect.isfunction)
+            if getattr(func, 'belong_to_server_api', False)
+        }
 
     def api_methods(self) -> {str: bool}:
         """Return map of methods of server that belongs to the API with
         a boolean indicating if it needs root to be used.
 
         """
-        return {
-            func.__name__: func in self.restricted_to_rooter
-            for _, func in inspect.getmembers(self, predicate=inspect.ismethod)
-            if callable(func) and getattr(func, 'belong_to_server_api', False)
-        }
+        return {name: api.rooter_only for name, api in self._api.items()}
 
     def api_methods_parameters(self) -> {str: (str,)}:
         """Return map of methods of server that belongs to the API with
         an iterable of the parameters name.
 
         """
-        return {
-            funcname: tuple(inspect.signature(getattr(self, funcname)).parameters.keys())
-            for funcname in self.api_methods()
-        }
+        return {name: api.parameters for name, api in self._api.items()}
 
 
     @api_method
@@ -122,10 +323,8 @@ class Server:
 
         """
         if token in self.tokens_rooter:
-            return self.api_methods_parameters()
-        return {name: params for name, params
-                in self.api_methods_parameters().items()
-                if not getattr(self, name) in self.restricted_to_rooter}
+            return self._api_parameters
+        return self._player_api_parameters
 
 
     @api_method
@@ -161,46 +360,71 @@ class Server:
         """Receive data, decrypt it, run the command, perform the encryption
         of the return value.
 
-        Input data is expected to be a json formatted payload.
+        Input data is expected to be a json formatted payload, holding
+        a command (name, args, kwargs), or a batch of commands as a list
+        of them. The result of a batch is the list of the status and
+        payload of each command, encrypted for the first token found.
 
         """
         data = wjson.from_json(data)
         assert set(data.keys()) == {'encryption_key', 'payload'}
         data_payload, data_key = data['payload'], data['encryption_key']
-        command, args, kwargs = self.decrypt_user_command(
+        commands = self.decrypt_user_command(
             base64.b64decode(data_payload) if data_key else data_payload,
             base64.b64decode(data_key) if data_key else None,
         )
-        command_method = getattr(self, command)
-        if command in self.api_methods():
+        if not commands or isinstance(commands[0], list):  # batch of commands
+            outcomes = [self._run_command(*command, in_batch=True) for command in commands]
+            result = wjson.as_json([{'status': 'succeed' if succeed else 'failed',
+                                     'encryption_key': None, 'payload': payload}
+                                    for succeed, payload, _ in outcomes])
+            token = next((token for _, _, token in outcomes if token), None)
+        else:
+            succeed, result, token = self._run_command(*commands)
+            if not succeed:
+                return ERROR_PAYLOAD.format(result)
+        payload, key = self.encrypt_for_user(result, token)
+        if key:  # then the payload have been encrypted
+            key = base64.b64encode(key).decode()
+            payload = base64.b64encode(payload).decode()
+        assert isinstance(key, str) or key is None
+        assert isinstance(payload, str)
+        tosend = {
+            'status': 'succeed',
+            'encryption_key': key,
+            'payload': payload,
+        }
+        return wjson.as_json(tosend)
+
+    def _run_command(self, command:str, args:list, kwargs:dict, *,
+                     in_batch:bool=False) -> (bool, str, str or None):
+        """Run given command of the API, and return True if it succeed,
+        its result as json (or the error message), and the caller token.
+
+        In a batch, any error is reported as a failure of the command,
+        so it does not prevent the other commands to be answered.
+
+        """
+        api = self._api.get(command)
+        if not api:  # command not in api methods
+            return False, 'Unknow command.', None
+        try:
             try:
-                try:
-                    result = command_method(*args, **kwargs)
-                    if True or not isinstance(result, str):  # result must be str
-                        result = wjson.as_json(result)
-                except TypeError as err:  # unwanted parameters
-                    raise ServerError('|'.join(err.args))
-                token = None
-                if command_method.need_token:
-                    token = kwargs.get('token') or args[0]
-                payload, key = self.encrypt_for_user(result, token)
-                if key:  # then the payload have been encrypted
-                    key = base64.b64encode(key).decode()
-                    payload = base64.b64encode(payload).decode()
-                assert isinstance(key, str) or key is None
-                assert isinstance(payload, str)
-                tosend = {
-                    'status': 'succeed',
-                    'encryption_key': key,
-                    'payload': payload,
-                }
-                tosend = wjson.as_json(tosend)
-            except ServerError as err:
-                print('ServerError:', '|'.join(map(str, err.args)))
-                tosend = ERROR_PAYLOAD.format(err.args[0])
-        else:  # command not in api methods
-            tosend = ERROR_PAYLOAD.format('Unknow command.')
-        return tosend
+                result = wjson.as_json(api.method(*args, **kwargs))  # result must be str
+            except TypeError as err:  # unwanted parameters
+                raise ServerError('|'.join(err.args))
+        except ServerError as err:
+            print('ServerError:', '|'.join(map(str, err.args)))
+            return False, err.args[0], None
+        except Exception as err:
+            if not in_batch:
+                raise
+            print('Error:', repr(err))
+            return False, '{}: {}'.format(type(err).__name__, err), None
+        token = None
+        if api.need_token:
+            token = kwargs.get('token') or args[0]
+        return True, result, token
 
 
 
@@ -215,14 +439,11 @@ class Server:
             if not valider(name):
                 raise ServerError('Bad name: ' + str(err))
             new = str(uuid.uuid4())
-            token_set.add(new)
-            self._players_name[new] = str(name)
-            self._players_from_name[str(name)] = new
             if public_key:
                 public_key = HybridEncryption.publickey_from(public_key)
                 public_key = HybridEncryption.publickey_to_bytes_from_obj(public_key)
-            assert isinstance(public_key, bytes) or public_key is None
-            self._players_encryption_key[new] = public_key
+                public_key = base64.b64encode(public_key).decode()
+            self._record('player', new, str(name), root, public_key)
             return new
         else:
             raise ServerError('Registration failed: bad password.')
@@ -242,21 +463,22 @@ class Server:
 
     @api_method
     def register_problem(self, token:str, title:str, description:str,
-                         public_tests:str, hidden_tests:str) -> id:
-        """Register a new problem with given description and tests,
-        and open its session.
+                         public_tests:str, hidden_tests:str,
+                         benchmarks:[Benchmark]=()) -> id:
+        """Register a new problem with given description, tests
+        and benchmarks, and open its session.
 
         """
-        if title in self.problems:
-            author = self._players_name.get(self.problems[title].author, None)
-            if self._players_name[token] == author:
-                raise ServerError("You already submited a problem of title '{}'".format(title))
-            raise ServerError("{} already submited a problem of title '{}'".format(author, title))
-        problem = Problem(self._yield_problem_id(), title, description,
-                          public_tests, hidden_tests, author=token)
-        self.problems_by_id[problem.id] = problem
-        self.problems[problem.title] = problem
-        self.open_problems.add(problem.id)
+        with self._state_lock:
+            if title in self.problems:
+                author = self._players_name.get(self.problems[title].author, None)
+                if self._players_name[token] == author:
+                    raise ServerError("You already submited a problem of title '{}'".format(title))
+                raise ServerError("{} already submited a problem of title '{}'".format(author, title))
+            problem = Problem(self._yield_problem_id(), title, description,
+                              public_tests, hidden_tests, author=token,
+                              benchmarks=benchmarks)
+            self._record('problem', problem)
         return problem.as_public_data()
 
     def _get_problem(self, problem_id:Problem or int or str) -> Problem or ServerError:
@@ -294,11 +516,9 @@ class Server:
     def close_problem_session(self, token:str, problem_id:int or str) -> None or ServerError:
         """Remove given problem of the list of open problems"""
         problem = self._get_problem(problem_id)
-        try:
-            self.open_problems.remove(problem.id)
-        except KeyError:  # problem not in open problems
+        # if problem.id not in self.open_problems:
             # raise ServerError("Given problem ({}) is already closed".format(problem.title))
-            pass
+        self._record('session', problem.id, False)
 
     @api_method
     def open_problem_session(self, token:str, problem_id:int or str) -> None or ServerError:
@@ -306,7 +526,7 @@ class Server:
         problem = self._get_problem(problem_id)
         # if problem in self.open_problems:
             # raise ServerError("Given problem ({}) is already open".format(problem.title))
-        self.open_problems.add(problem)
+        self._record('session', problem.id, True)
 
 
     @api_method
@@ -339,6 +559,61 @@ class Server:
         return tuple(self._players_involved_in(problem.id))
 
 
+    @api_method
+    def list_participations(self, token:str) -> [id]:
+        """Return id of problems the player participated to,
+        by submitting code or tests"""
+        return tuple(sorted(self._problems_involving(token)))
+
+    @api_method
+    def retrieve_submissions(self, token:str, problem_id:int or str) -> {str: [SubmissionResult]}:
+        """Return all submissions made for given problem, by player token.
+
+        Once closed, the problem submissions may then be dropped,
+        if its retention policy says so.
+
+        """
+        problem = self._get_problem(problem_id)
+        with self._state_lock:  # no submission between retrieval and export
+            submissions = {player: self._player_submissions(player, problem.id)
+                           for player in self._players_submit_solution_for(problem.id)}
+            self._record('export', problem.id)
+        return submissions
+
+    @api_method
+    def set_retention_policy(self, token:str, problem_id:int or str,
+                             full_submissions:int=None, drop_closed:bool=False) -> None:
+        """Set how long the submissions of given problem are kept:
+        only the full_submissions last ones of each player are kept in full,
+        the older being reduced to which tests passed (all kept in full if None),
+        and all are dropped once the problem is closed and its submissions
+        retrieved if drop_closed.
+
+        """
+        problem = self._get_problem(problem_id)
+        if full_submissions is not None and int(full_submissions) < 1:
+            raise ServerError("At least the last submission must be kept in full")
+        self._record('retention', problem.id,
+                     None if full_submissions is None else int(full_submissions),
+                     bool(drop_closed))
+
+    def _retention_targets(self) -> iter:
+        """Yield (problem id, retention policy, closed and exported) for all problems"""
+        for problem_id in tuple(self.problems_by_id):
+            policy = self._retention_policies.get(problem_id, self._retention_policy)
+            closed = (problem_id not in self.open_problems
+                      and problem_id in self._exported_problems)
+            yield problem_id, policy, closed
+
+
+    @api_method
+    def retrieve_grading_stats(self, token:str) -> dict:
+        """Return counters about the grading of submissions"""
+        return {'cache': self._grading_cache.stats,
+                'workers': self._grading_pool.nb_workers,
+                'runner': self._grading_pool.runner}
+
+
     @api_method
     def submit_solution(self, token:str, problem_id:int, source_code:str) -> ServerError or SubmissionResult:
         """Run unit tests for given problem using given solution.
@@ -349,8 +624,62 @@ class Server:
 
         Raise ServerError if problem_id is not valid, or a SubmissionResult object.
 
+        The submission is graded through the grading queue, like an
+        asynchronous one, so it is scheduled fairly among players.
+
         """
-        return self._run_tests_for_player(token, problem_id, source_code)
+        problem = self._get_problem(problem_id)
+        job = self._grading_queue.put(token, problem.id, source_code)
+        job.wait()
+        return self._grading_job_result(job)
+
+    @api_method
+    def submit_solution_async(self, token:str, problem_id:int, source_code:str) -> ServerError or str:
+        """Enqueue the testing of given solution for given problem,
+        and return immediately the id of the grading job.
+
+        Use get_submission_status and get_submission_result to follow the job.
+
+        """
+        problem = self._get_problem(problem_id)
+        return self._grading_queue.put(token, problem.id, source_code).id
+
+    @api_method
+    def get_submission_status(self, token:str, job_id:str) -> ServerError or str:
+        """Return the status of given grading job:
+        queued, running, done, failed or superseded.
+
+        """
+        return self._get_grading_job(token, job_id).status
+
+    @api_method
+    def get_submission_result(self, token:str, job_id:str) -> ServerError or SubmissionResult or None:
+        """Return the SubmissionResult of given grading job,
+        or None if the job is not finished.
+
+        Raise ServerError if the grading failed or was superseded.
+
+        """
+        return self._grading_job_result(self._get_grading_job(token, job_id))
+
+    def _grading_job_result(self, job:'GradingJob') -> ServerError or SubmissionResult or None:
+        """Return the result of given job, or raise a ServerError
+        if it will never have one.
+
+        """
+        if job.status == 'failed':
+            raise ServerError(job.error)
+        if job.status == 'superseded':
+            raise ServerError("Submission was superseded by a newer one ({})"
+                              "".format(job.superseded_by))
+        return job.result
+
+    def _get_grading_job(self, token:str, job_id:str) -> 'GradingJob' or ServerError:
+        """Access to a grading job submitted by given token"""
+        job = self._grading_queue.job(job_id)
+        if not job or job.token != token:
+            raise ServerError("Grading job {} do not exists".format(job_id))
+        return job
 
 
     @api_method
@@ -365,7 +694,7 @@ class Server:
         """Add test of given type to the given problem test adder. Raise
         a detailed ServerError if any problem.
 
-        problem_adder -- Problem.add_community_test or alike, binded to an instance
+        type -- type of the test (see Test.VALID_TEST_TYPES)
         author_token -- author of the test
         test_code -- source code sent by author
 
@@ -385,16 +714,20 @@ class Server:
         if problem.have_test(test.name):
             raise ServerError("A test is already named {}".format(test.name))
 
-        # verify that player succeeds on this new test
-        alt_problem = problem.copy()
-        alt_problem.add_community_test(Test(str(test_code), author_token, 'community'))
-        source_code = self._player_last_submission(author_token, problem.id).source_code
-        submission_result = self._run_tests_for_player(author_token, alt_problem, source_code, dry=True)
+        # verify that player succeeds on this new test ; other tests
+        #  results are already known from its last submission
+        submission_result = self._run_new_tests_for_player(author_token, problem,
+                                                           (test,), dry=True)
         if not submission_result.total_success:
             raise ServerError("Given test fail on last submission")
 
-        # All is ok: add the test to the problem
-        getattr(problem, 'add_{}_test'.format(type))(test)
+        # All is ok: add the test to the problem, giving its next version,
+        #  unless a concurrent upload took its name in the meantime
+        with self._state_lock:
+            if self.problems_by_id[problem.id].have_test(test.name):
+                raise ServerError("A test is already named {}".format(test.name))
+            self._record('test', problem.id, test)
+            self._regrade(self.problems_by_id[problem.id], (test,))
 
 
     @api_method
@@ -408,6 +741,43 @@ class Server:
         self._add_test_to_problem(problem_id, 'hidden', token, test_code)
 
 
+    @api_method
+    def retrieve_regrading_status(self, token:str, problem_id:int or str) -> dict or None:
+        """Return the progress of the last re-grading of given problem,
+        or None if its tests never changed.
+
+        """
+        regrading = self._regradings.get(self._get_problem(problem_id).id)
+        return regrading.status if regrading else None
+
+    def _regrade(self, problem:Problem, new_tests:[Test]) -> Regrading:
+        """Launch in background the grading of the last submission of
+        all players of given problem on given new tests,
+        once the previous re-grading of the problem is done.
+
+        Must be called with the state lock held, so re-gradings are chained
+        in the order of the tests versions.
+
+        """
+        nb_submissions = {}  # token: number of submissions when re-grading started
+        def last_submissions():
+            tokens = tuple(self._players_submit_solution_for(problem.id))
+            nb_submissions.update((token, self._db.nb_submissions(token, problem.id))
+                                  for token in tokens)
+            return {token: self._player_last_submission(token, problem.id)
+                    for token in tokens}
+        def store(token, last_submission, result):
+            # do not hide a submission made during the re-grading
+            if self._db.nb_submissions(token, problem.id) == nb_submissions[token]:
+                self._update_player_state(token, result.source_code, result)
+        regrading = Regrading(problem, new_tests, last_submissions,
+                              self._submit_grading, store,
+                              previous=self._regradings.get(problem.id),
+                              max_trace_size=self._grading_pool.limits.trace_size)
+        self._regradings[problem.id] = regrading
+        return regrading
+
+
     def _test_upload_allowed(self, token:str, problem_id:int) -> bool:
         if self._player_succeed_all_tests(token, problem_id):
             return True
@@ -416,19 +786,18 @@ class Server:
         return False
 
 
-    def _validate_token(self, token:str, method:callable=None) -> ServerError or None:
-        """Raise an error if given token do not have access to given method"""
+    def _validate_token(self, token:str, method_name:str=None) -> ServerError or None:
+        """Raise an error if given token do not have access to the method of given name"""
         rooter = token in self.tokens_rooter
         player = token in self.tokens_player
-        need_rooter = method in self.restricted_to_rooter
+        api = self._api.get(method_name)
+        need_rooter = api is not None and api.rooter_only
         if not rooter and not player:
             raise ServerError("Given token ({}) is not allowed to do anything."
                              "".format(token))
         if not rooter and need_rooter:
-            error_msg = lambda func: func
-            method_name = method.__name__.replace('_', ' ')
             raise ServerError("Given token is not allowed to {}"
-                             "".format(method_name))
+                             "".format(method_name.replace('_', ' ')))
 
 
     def _update_player_state(self, token:str, source_code:str, result:SubmissionResult):
@@ -436,22 +805,24 @@ class Server:
         and given submission result.
 
         """
-        self._db[token][result.problem_id].append(result)
+        if self._db.persistent:  # the database is its own journal
+            with self._state_lock:
+                exported = result.problem_id in self._exported_problems
+                self._apply_submission(token, result)
+            self._db.flush()  # written before returning, as journaled events
+            if exported:  # the journal must know it is not anymore
+                self._record('export', result.problem_id, False)
+        else:
+            self._record('submission', token, result)
 
 
     def _player_submissions(self, token:str, problem_id:str) -> [(str, str)]:
         """Return player sources code and results for given problem"""
-        try:
-            return tuple(self._db[token][problem_id])
-        except IndexError:
-            return ()
+        return self._db.submissions(token, problem_id)
 
     def _player_last_submission(self, token:str, problem_id:str) -> (str, str) or None:
         """Return last player source code and results for given problem"""
-        try:
-            return self._db[token][problem_id][-1]
-        except IndexError:
-            return None
+        return self._db.last_submission(token, problem_id)
 
     def _player_succeed_all_tests(self, token:str, problem_id:str) -> bool:
         """True if player of given token has succeed for all tests"""
@@ -460,33 +831,86 @@ class Server:
         return all(test.succeed for test in last_sub.tests)
 
     def _run_tests_for_player(self, token:str, problem_id:int, source_code:str,
-                              *, dry=False) -> SubmissionResult:
+                              *, dry=False, priority_tests:iter=()) -> SubmissionResult:
         """Perform the testing of player of given token on unit tests of
         given problem using the player source code.
 
-        dry -- do not write results in database. Just run the tests.
+        dry -- do not write results in database. Just run the tests,
+               until the first failure: the result is partial.
+        priority_tests -- names of tests to run first in dry mode.
 
         """
         problem = self._get_problem(problem_id)
         problem_id = problem.id
-        result = result_from_pytest(problem, source_code)
+        result = self._grade(problem, source_code, dry=dry,
+                             priority_tests=priority_tests)
         if not dry:
             self._update_player_state(token, source_code, result)
         assert isinstance(result, SubmissionResult)
         return result
 
+    def _run_new_tests_for_player(self, token:str, problem_id:int, new_tests:[Test],
+                                  *, dry=False) -> SubmissionResult or ServerError:
+        """Perform the testing of the last submission of player of given
+        token on given new tests only, and merge the results with the ones
+        of the last submission.
+
+        dry -- do not write results in database. Just run the tests,
+               new ones first, until the first failure.
+
+        """
+        problem = self._get_problem(problem_id)
+        last_submission = self._player_last_submission(token, problem.id)
+        if not last_submission:
+            raise ServerError("Given token did not submit any solution")
+        source_code = last_submission.source_code
+        new_tests = tuple(new_tests)
+        new_result = self._grade(problem.restricted_to(new_tests), source_code,
+                                 dry=dry, priority_tests=(test.name for test in new_tests))
+        result = merge_submission_results(last_submission, new_result,
+                                          self._grading_pool.limits.trace_size)
+        if not dry:
+            self._update_player_state(token, source_code, result)
+        return result
+
+    def _grade(self, problem:Problem, source_code:str, **kwargs) -> SubmissionResult:
+        """Return the result of given source code on given problem tests,
+        taken from the cache if already computed.
+
+        """
+        return self._submit_grading(problem, source_code, **kwargs).result()
+
+    def _submit_grading(self, problem:Problem, source_code:str, *,
+                        dry:bool=False, priority_tests:iter=()) -> Future:
+        """Return a future on the result of given source code on given
+        problem tests, already resolved if found in cache.
+
+        dry -- stop at the first failing test, running first the tests
+               of given names. The partial result is not cached.
+
+        """
+        result = self._grading_cache.get(problem, source_code)
+        if result is not None:
+            future = Future()
+            future.set_result(result)
+            return future
+        future = self._grading_pool.submit(problem, source_code, dry=dry,
+                                           priority_tests=priority_tests)
+        def put_in_cache(future):
+            if not dry and not future.exception():
+                self._grading_cache.put(problem, source_code, future.result())
+        future.add_done_callback(put_in_cache)
+        return future
+
     def _players_submit_solution_for(self, problem_id:str) -> iter:
         """Yield token of players that have submitted code to given problem."""
         problem_id = self._get_problem(problem_id).id
-        yield from (
-            token for token, problem_ids in self._db.items()
-            if problem_id in problem_ids
-        )
+        yield from self._db.tokens_of(problem_id)
 
     def _players_submit_test_for(self, problem_id:str) -> iter:
         """Yield token of players that have submitted test to given problem."""
-        problem = self._get_problem(problem_id)
-        yield from (self._players_from_name[test.author] for test in problem.community_tests)
+        problem_id = self._get_problem(problem_id).id
+        yield from tuple(self._test_authors.get(problem_id, ()))
 
     def _players_involved_in(self, problem_id:str) -> frozenset:
         """Return set of token of players that have participated to given problem,
@@ -495,3 +919,10 @@ class Server:
         coders = self._players_submit_solution_for(problem_id)
         testers = self._players_submit_test_for(problem_id)
         return frozenset(coders) | frozenset(testers)
+
+    def _problems_involving(self, token:str) -> frozenset:
+        """Return set of id of problems given player participated to,
+        by submitting code or tests.
+        """
+        return (frozenset(self._db.problems_of(token))
+                | frozenset(self._tested_problems.get(token, ())))
@@ -0,0 +1,428 @@
+"""Implementation of the storage of submissions.
+
+The Server keeps the submissions of players in a storage, that is either
+in memory (the default, lost when the server stops), or in a SQLite
+database, that holds a whole semester of submissions without keeping
+them in RAM, and survive a crash.
+
+The SQLite storage also records players, problems and tests,
+so the database is a complete archive of the session.
+
+The memory storage keeps source codes and traces in a BlobStore, where
+identical texts are stored once, compressed, and decompressed only when
+accessed.
+
+"""
+
+import time
+import zlib
+import hashlib
+import sqlite3
+import threading
+from collections import defaultdict
+
+import wjson
+from commons import SubmissionResult, TestResult
+from retention import submission_summary
+
+
+COMPRESSION_LEVEL = 6  # zlib default: good ratio for a fraction of the time of 9
+BATCH_SIZE = 100  # number of submissions written in one transaction
+FLUSH_INTERVAL = 1.  # seconds before pending submissions are written anyway
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    token TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    rooter INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS problems (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    source_name TEXT NOT NULL,
+    author TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tests (
+    problem_id INTEGER NOT NULL REFERENCES problems (id),
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    author TEXT NOT NULL,
+    source_code TEXT NOT NULL,
+    PRIMARY KEY (problem_id, name)
+);
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token TEXT NOT NULL,
+    problem_id INTEGER NOT NULL,
+    timestamp REAL NOT NULL,
+    source_code TEXT NOT NULL,
+    full_trace TEXT NOT NULL,
+    grading_time REAL,
+    cpu_time REAL,
+    peak_memory INTEGER,
+    benchmarks TEXT NOT NULL  -- json list of BenchmarkResult
+);
+CREATE INDEX IF NOT EXISTS submissions_of_player
+    ON submissions (token, problem_id);  -- ordered by id, the order of submission
+CREATE INDEX IF NOT EXISTS players_of_problem
+    ON submissions (problem_id, token);
+CREATE TABLE IF NOT EXISTS test_results (
+    submission_id INTEGER NOT NULL REFERENCES submissions (id),
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    succeed INTEGER NOT NULL,
+    status TEXT,
+    duration REAL,
+    PRIMARY KEY (submission_id, position)
+);
+"""
+
+
+class Blob:
+    """Compressed text stored in a BlobStore"""
+    __slots__ = ('key', 'data', 'references')
+
+    def __init__(self, key:bytes, data:bytes):
+        self.key, self.data, self.references = key, data, 0
+
+    @property
+    def text(self) -> str:
+        return zlib.decompress(self.data).decode()
+
+
+class BlobStore:
+    """Content-addressed store of texts, kept compressed.
+
+    Texts are identified by their hash, so identical texts are stored once.
+    Each put() of a text must be balanced by a release() of its blob:
+    the store forgets a blob when no longer referenced.
+    Released blobs stay readable by who still holds them.
+
+    """
+
+    def __init__(self, compression_level:int=COMPRESSION_LEVEL):
+        self.compression_level = int(compression_level)
+        self._blobs = {}  # hash: Blob
+        self._lock = threading.Lock()
+
+    def put(self, text:str) -> Blob:
+        """Store given text, and return its blob"""
+        data = text.encode()
+        key = hashlib.sha256(data).digest()
+        with self._lock:
+            blob = self._blobs.get(key)
+            if blob is None:
+                blob = self._blobs[key] = Blob(key, zlib.compress(data, self.compression_level))
+            blob.references += 1
+        return blob
+
+    def release(self, blob:Blob):
+        """Forget a reference to given blob"""
+        with self._lock:
+            blob.references -= 1
+            if not blob.references:
+                del self._blobs[blob.key]
+
+    def __len__(self) -> int:
+        return len(self._blobs)
+
+    @property
+    def size(self) -> int:
+        """Number of bytes used by the compressed texts"""
+        return sum(len(blob.data) for blob in tuple(self._blobs.values()))
+
+
+class StoredSubmissionResult(SubmissionResult):
+    """SubmissionResult keeping its source code and trace in a BlobStore"""
+    __slots__ = ('_store',)
+
+    def __init__(self, store:BlobStore, result:SubmissionResult):
+        fields = {field: getattr(result, field) for field in result.fields}
+        fields['source_code'] = store.put(result.source_code)
+        fields['full_trace'] = store.put(result.full_trace)
+        super().__init__(**fields)
+        self._store = store
+
+    source_code = property(lambda self: self._source_code.text)
+    full_trace = property(lambda self: self._full_trace.text)
+
+    def release(self):
+        """Forget the texts of the submission in the store"""
+        self._store.release(self._source_code)
+        self._store.release(self._full_trace)
+
+
+class MemoryStorage:
+    """Storage keeping everything in memory"""
+    persistent = False  # submissions are lost when the server stops
+
+    def __init__(self):
+        self._submissions = defaultdict(lambda: defaultdict(list))  # token: {problem_id: [result]}
+        self._tokens_of = defaultdict(dict)  # problem_id: {token: None}, in submission order
+        self.blobs = BlobStore()
+
+    def add_player(self, token:str, name:str, rooter:bool=False):
+        pass  # players are known by the Server itself
+
+    def add_problem(self, problem):
+        pass  # problems are known by the Server itself
+
+    def add_test(self, problem_id:int, test):
+        pass  # tests are known by the problems
+
+    def add_submission(self, token:str, result:SubmissionResult):
+        self._submissions[token][result.problem_id].append(
+            StoredSubmissionResult(self.blobs, result))
+        self._tokens_of[result.problem_id][token] = None
+
+    def submissions(self, token:str, problem_id:int) -> (SubmissionResult,):
+        """Return submissions of given player for given problem, oldest first"""
+        return tuple(self._submissions.get(token, {}).get(problem_id, ()))
+
+    def last_submission(self, token:str, problem_id:int) -> SubmissionResult or None:
+        submissions = self._submissions.get(token, {}).get(problem_id)
+        return submissions[-1] if submissions else None
+
+    def nb_submissions(self, token:str, problem_id:int) -> int:
+        return len(self._submissions.get(token, {}).get(problem_id, ()))
+
+    def tokens_of(self, problem_id:int) -> iter:
+        """Yield tokens of players that have submitted code to given problem"""
+        yield from tuple(self._tokens_of.get(problem_id, ()))
+
+    def problems_of(self, token:str) -> iter:
+        """Yield id of problems given player submitted code to"""
+        yield from tuple(self._submissions.get(token, ()))
+
+    def compact(self, token:str, problem_id:int, nb_kept:int) -> int:
+        """Replace the submissions of given player for given problem by their
+        summary (see retention.py), except the nb_kept last ones.
+        Return the number of submissions compacted.
+
+        """
+        assert nb_kept > 0, "last submission is needed for re-grading"
+        submissions = self._submissions.get(token, {}).get(problem_id, [])
+        compacted = 0
+        # new submissions are appended: the old ones keep their index
+        for index in range(len(submissions) - nb_kept):
+            result = submissions[index]
+            if isinstance(result, StoredSubmissionResult):
+                submissions[index] = submission_summary(result)
+                result.release()
+                compacted += 1
+        return compacted
+
+    def drop(self, problem_id:int):
+        """Forget all submissions for given problem"""
+        self._tokens_of.pop(problem_id, None)
+        for problems in tuple(self._submissions.values()):
+            for result in problems.pop(problem_id, ()):
+                if isinstance(result, StoredSubmissionResult):
+                    result.release()
+
+    def all_submissions(self) -> iter:
+        """Yield all (token, submission) pairs, oldest first for each player"""
+        for token, problems in tuple(self._submissions.items()):
+            for submissions in tuple(problems.values()):
+                yield from ((token, result) for result in tuple(submissions))
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage:
+    """Storage writing everything in a SQLite database.
+
+    Submissions are written by batches, in one transaction per batch,
+    at most FLUSH_INTERVAL seconds after being added. Pending submissions
+    are written before any query, so queries always see all of them.
+    A flush writes all submissions added while the previous one was running,
+    so callers flushing to make their submission durable share a transaction
+    (group commit).
+
+    """
+    persistent = True
+
+    def __init__(self, path:str, batch_size:int=BATCH_SIZE,
+                 flush_interval:float=FLUSH_INTERVAL):
+        self.path = str(path)
+        self.batch_size = int(batch_size)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        # transactions are synced on disk, like the events of the Journal
+        self._connection.execute('PRAGMA synchronous=FULL')
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.RLock()
+        self._pending = []  # (token, timestamp, SubmissionResult) to write
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically,
+                                         args=(flush_interval,), daemon=True)
+        self._flusher.start()
+
+    def add_player(self, token:str, name:str, rooter:bool=False):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO players VALUES (?, ?, ?)',
+                                     (token, name, int(rooter)))
+
+    def add_problem(self, problem):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO problems VALUES (?, ?, ?, ?, ?)',
+                (problem.id, problem.title, problem.description,
+                 problem.source_name, problem.author)
+            )
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO tests VALUES (?, ?, ?, ?, ?)',
+                ((problem.id, test.name, test.type, test.author, test.source_code)
+                 for test in problem.tests)
+            )
+
+    def add_test(self, problem_id:int, test):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO tests VALUES (?, ?, ?, ?, ?)',
+                                     (problem_id, test.name, test.type, test.author,
+                                      test.source_code))
+
+    def add_submission(self, token:str, result:SubmissionResult):
+        with self._lock:
+            self._pending.append((token, time.time(), result))
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """Write the pending submissions in one transaction"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return
+            with self._connection:
+                for token, timestamp, result in pending:
+                    cursor = self._connection.execute(
+                        'INSERT INTO submissions (token, problem_id, timestamp,'
+                        ' source_code, full_trace, grading_time, cpu_time,'
+                        ' peak_memory, benchmarks) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (token, result.problem_id, timestamp, result.source_code,
+                         result.full_trace, result.grading_time, result.cpu_time,
+                         result.peak_memory, wjson.as_json(list(result.benchmarks)))
+                    )
+                    self._connection.executemany(
+                        'INSERT INTO test_results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        ((cursor.lastrowid, position, test.name, test.type,
+                          int(test.succeed), test.status, test.duration)
+                         for position, test in enumerate(result.tests))
+                    )
+
+    def submissions(self, token:str, problem_id:int) -> (SubmissionResult,):
+        """Return submissions of given player for given problem, oldest first"""
+        return tuple(self._query_submissions(
+            'WHERE token = ? AND problem_id = ? ORDER BY id',
+            (token, problem_id)
+        ))
+
+    def last_submission(self, token:str, problem_id:int) -> SubmissionResult or None:
+        found = self._query_submissions(
+            'WHERE token = ? AND problem_id = ? ORDER BY id DESC LIMIT 1',
+            (token, problem_id)
+        )
+        return found[0] if found else None
+
+    def nb_submissions(self, token:str, problem_id:int) -> int:
+        with self._lock:
+            self.flush()
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM submissions WHERE token = ? AND problem_id = ?',
+                (token, problem_id)
+            ).fetchone()[0]
+
+    def tokens_of(self, problem_id:int) -> iter:
+        """Yield tokens of players that have submitted code to given problem"""
+        with self._lock:
+            self.flush()
+            rows = self._connection.execute(
+                'SELECT DISTINCT token FROM submissions WHERE problem_id = ?',
+                (problem_id,)
+            ).fetchall()
+        yield from (token for token, in rows)
+
+    def problems_of(self, token:str) -> iter:
+        """Yield id of problems given player submitted code to"""
+        with self._lock:
+            self.flush()
+            rows = self._connection.execute(
+                'SELECT DISTINCT problem_id FROM submissions WHERE token = ?', (token,)
+            ).fetchall()
+        yield from (problem_id for problem_id, in rows)
+
+    def compact(self, token:str, problem_id:int, nb_kept:int) -> int:
+        """Replace the submissions of given player for given problem by their
+        summary (see retention.py), except the nb_kept last ones.
+        Return the number of submissions compacted.
+
+        """
+        assert nb_kept > 0, "last submission is needed for re-grading"
+        with self._lock:
+            self.flush()
+            ids = [id for id, in self._connection.execute(
+                'SELECT id FROM submissions WHERE token = ? AND problem_id = ?'
+                " AND (source_code != '' OR full_trace != '')"
+                ' ORDER BY id DESC LIMIT -1 OFFSET ?',
+                (token, problem_id, nb_kept)
+            )]
+            with self._connection:
+                self._connection.executemany(
+                    "UPDATE submissions SET source_code = '', full_trace = '',"
+                    " benchmarks = '[]' WHERE id = ?", ((id,) for id in ids))
+                self._connection.executemany(
+                    'UPDATE test_results SET status = NULL, duration = NULL'
+                    ' WHERE submission_id = ?', ((id,) for id in ids))
+        return len(ids)
+
+    def drop(self, problem_id:int):
+        """Forget all submissions for given problem"""
+        with self._lock:
+            self.flush()
+            with self._connection:
+                self._connection.execute(
+                    'DELETE FROM test_results WHERE submission_id IN'
+                    ' (SELECT id FROM submissions WHERE problem_id = ?)', (problem_id,))
+                self._connection.execute('DELETE FROM submissions WHERE problem_id = ?',
+                                         (problem_id,))
+
+    def _query_submissions(self, condition:str, parameters:tuple) -> [SubmissionResult]:
+        """Return the submissions found with given SQL condition"""
+        with self._lock:
+            self.flush()
+            rows = self._connection.execute(
+                'SELECT id, problem_id, source_code, full_trace, grading_time,'
+                ' cpu_time, peak_memory, benchmarks FROM submissions ' + condition,
+                parameters
+            ).fetchall()
+            tests = {row[0]: [] for row in rows}  # submission id: [TestResult]
+            for id, name, type, succeed, status, duration in self._connection.execute(
+                'SELECT submission_id, name, type, succeed, status, duration'
+                ' FROM test_results WHERE submission_id IN'
+                ' (SELECT id FROM submissions ' + condition + ')'
+                ' ORDER BY submission_id, position', parameters
+            ):
+                tests[id].append(TestResult(name, type, bool(succeed), status, duration))
+        return [SubmissionResult(tests=tests[id], full_trace=full_trace,
+                                 problem_id=problem_id, source_code=source_code,
+                                 grading_time=grading_time, cpu_time=cpu_time,
+                                 peak_memory=peak_memory,
+                                 benchmarks=wjson.from_json(benchmarks))
+                for (id, problem_id, source_code, full_trace, grading_time,
+                     cpu_time, peak_memory, benchmarks) in rows]
+
+    def _flush_periodically(self, interval:float):
+        while not self._closed.wait(interval):
+            self.flush()
+
+    def close(self):
+        """Write pending submissions and close the database"""
+        self._closed.set()
+        self._flusher.join()
+        with self._lock:
+            self.flush()
+            self._connection.close()
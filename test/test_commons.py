@@ -0,0 +1,17 @@
+from commons import BoundedTrace, TRUNCATION_MARKER, bounded_trace
+
+
+def test_bounded_trace_keeps_head_and_tail():
+    trace = BoundedTrace(10)
+    for line in ('abc\n', 'defgh\n', 'ijklmn\n', 'opq\n'):
+        trace.write(line)
+    assert trace.truncated == 11
+    assert trace.getvalue() == 'abc\nd' + TRUNCATION_MARKER.format(11) + '\nopq\n'
+
+
+def test_unbounded_trace():
+    trace = BoundedTrace()
+    trace.write('a' * 1000)
+    assert trace.getvalue() == 'a' * 1000 and not trace.truncated
+    assert bounded_trace('é' * 10, 40) == 'é' * 10
+    assert bounded_trace('é' * 10, 8) == 'éé' + TRUNCATION_MARKER.format(12) + 'éé'
@@ -0,0 +1,398 @@
+
+import os
+import shutil
+import signal
+import subprocess
+import time
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from wtest import Test as WTest
+from problem import Problem
+from benchmark import Benchmark
+from grading import GradingPool
+from run_pytest import (MATERIALIZER_FILE, Limits, materialized_tests_dir,
+                        populate_run_dir, run_pytest_in_process, materialization_dir)
+
+
+def make_problem() -> Problem:
+    tests = (WTest("def test_answer():\n    assert answer() == 42\n",
+                  'teacher', 'public', name='test_answer'),)
+    return Problem(1, 'answer', 'Return 42', tests, ())
+
+
+def test_concurrent_jobs_are_isolated(tmpdir):
+    pool = GradingPool(2, scratch_root=str(tmpdir))
+    sources = ['def answer():\n    return {}\n'.format(i) for i in range(40, 44)]
+    futures = [pool.submit(make_problem(), source) for source in sources]
+    results = [future.result() for future in futures]
+    pool.shutdown()
+    assert [result.source_code for result in results] == sources
+    assert all(result.problem_id == 1 for result in results)
+    assert os.listdir(str(tmpdir)) == []  # scratch directories are removed
+
+
+def test_inprocess_runner_reuses_worker():
+    pool = GradingPool(1, runner='inprocess')
+    problem = make_problem()
+    bad = pool.grade(problem, 'def answer():\n    return 41\n')
+    good = pool.grade(problem, 'def answer():\n    return 42\n')
+    broken = pool.grade(problem, 'def answer(:\n')
+    pool.shutdown()
+    assert [(test.name, test.status) for test in bad.tests] == [('answer', 'failed')]
+    assert [(test.name, test.status) for test in good.tests] == [('answer', 'passed')]
+    assert [(test.name, test.status) for test in broken.tests] == [('answer', 'error')]
+    assert good.total_success and not bad.total_success and not broken.total_success
+    assert all(test.duration is not None for test in good.tests)
+
+
+def test_inprocess_runner_survives_killed_worker():
+    pool = GradingPool(1, runner='inprocess')
+    problem = make_problem()
+    try:
+        pool.grade(problem, 'import os\nos._exit(1)\n')
+        assert False, "killed worker was not detected"
+    except BrokenProcessPool:
+        pass
+    assert pool.grade(problem, 'def answer():\n    return 42\n').total_success
+    pool.shutdown()
+
+
+class Secret:
+    """Stands for the server state, that graders must not hold"""
+SECRET = Secret()
+PRYING_SOURCE = """
+import gc
+def answer():
+    found = any(type(obj).__name__ == 'Secret' for obj in gc.get_objects())
+    return 0 if found else 42
+"""
+
+
+def test_graders_do_not_hold_the_server_state():
+    assert SECRET
+    for runner in ('zygote', 'inprocess'):
+        pool = GradingPool(1, runner=runner)
+        result = pool.grade(make_problem(), PRYING_SOURCE)
+        pool.shutdown()
+        assert result.total_success, runner
+
+
+def test_subprocess_runner():
+    pool = GradingPool(1, runner='subprocess')
+    result = pool.grade(make_problem(), 'def answer():\n    return 42\n')
+    pool.shutdown()
+    assert [(test.name, test.status) for test in result.tests] == [('answer', 'passed')]
+
+
+def test_zygote_runner(tmpdir):
+    pool = GradingPool(2, scratch_root=str(tmpdir), runner='zygote')
+    problem = make_problem()
+    sources = ['def answer():\n    return {}\n'.format(i) for i in range(40, 44)]
+    futures = [pool.submit(problem, source) for source in sources]
+    results = [future.result() for future in futures]
+    assert [result.total_success for result in results] == [False, False, True, False]
+    assert [result.source_code for result in results] == sources
+    pool.shutdown()
+    assert os.listdir(str(tmpdir)) == []  # template and job directories are removed
+
+
+def test_dead_zygote_is_replaced(tmpdir):
+    pool = GradingPool(1, scratch_root=str(tmpdir), runner='zygote')
+    problem = make_problem()
+    zygote = pool.zygote(problem)
+    future = pool.submit(problem, 'def answer():\n    return 42\n')
+    os.kill(zygote._process.pid, signal.SIGKILL)
+    try:
+        future.result(timeout=10)  # killed before or after grading
+    except RuntimeError:
+        pass
+    zygote._process.join()
+    assert pool.grade(problem, 'def answer():\n    return 42\n').total_success
+    assert pool.zygote(problem) is not zygote
+    pool.shutdown()
+
+
+def test_zygotes_of_restricted_problems_are_kept_apart():
+    pool = GradingPool(1, runner='zygote', max_zygotes=2)
+    problem = make_problem()
+    zygote = pool.zygote(problem)
+    restricted = pool.zygote(problem.restricted_to(()))
+    assert restricted is not zygote and pool.zygote(problem) is zygote
+    newer = problem.with_test(WTest("def test_other():\n    assert answer()\n",
+                                    'teacher', 'hidden', name='test_other'))
+    newer_zygote = pool.zygote(newer)
+    for thread in pool._retiring:
+        thread.join()
+    assert not zygote.alive and not restricted.alive  # older version
+    assert pool.zygote(newer) is newer_zygote and newer_zygote.alive
+    restricted = pool.zygote(newer.restricted_to(newer.hidden_tests))
+    pool.zygote(newer.restricted_to(newer.public_tests))
+    for thread in pool._retiring:
+        thread.join()
+    assert not newer_zygote.alive and restricted.alive  # least recently used
+    pool.shutdown()
+
+
+@pytest.mark.parametrize('runner', ['zygote', 'inprocess'])
+def test_unused_materialized_tests_are_deleted(runner):
+    pool = GradingPool(1, runner=runner, max_zygotes=1)
+    def tests_dirs(*expected):  # once the jobs and zygotes are done with others
+        expected = sorted(os.path.basename(materialization_dir(problem, pool.tests_cache))
+                          for problem in expected)
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            for thread in pool._retiring:
+                thread.join()
+            found = sorted(name for name in os.listdir(pool.tests_cache)
+                           if not name.startswith('.'))
+            if found == expected:
+                break
+            time.sleep(0.01)
+        return found, expected
+    problem = make_problem()
+    assert pool.grade(problem, 'def answer():\n    return 42\n').total_success
+    found, expected = tests_dirs(problem)
+    assert found == expected
+    newer = problem.with_test(WTest("def test_other():\n    assert answer()\n",
+                                    'teacher', 'hidden', name='test_other'))
+    pool.grade(newer, 'def answer():\n    return 42\n')
+    found, expected = tests_dirs(newer)  # older version
+    assert found == expected
+    for tests in (newer.hidden_tests, newer.public_tests):
+        pool.grade(newer.restricted_to(tests), 'def answer():\n    return 42\n')
+    found, expected = tests_dirs(newer.restricted_to(newer.public_tests))  # least recently used
+    assert found == expected
+    pool.shutdown()
+
+
+def test_workers_are_shared_by_problems():
+    pool = GradingPool(1, runner='zygote')
+    problems = make_problem(), make_problem().copy(id=2)
+    source = 'import time\ndef answer():\n    time.sleep(0.5)\n    return 42\n'
+    pool.grade(problems[0], source), pool.grade(problems[1], source)  # warm zygotes
+    start = time.monotonic()
+    futures = [pool.submit(problem, source) for problem in problems]
+    assert all(future.result().total_success for future in futures)
+    assert time.monotonic() - start >= 1.  # one after the other
+    pool.shutdown()
+
+
+LOOPING_SOURCE = '''
+def answer():
+    while True:
+        try:
+            pass
+        except Exception:
+            pass
+'''
+STUBBORN_SOURCE = '''
+def answer():
+    while True:
+        try:
+            while True:
+                pass
+        except BaseException:
+            pass
+'''
+
+
+def test_timeouts():
+    limits = Limits(test_timeout=0.2, submission_timeout=5)
+    for runner in ('inprocess', 'zygote'):
+        pool = GradingPool(1, runner=runner, limits=limits)
+        result = pool.grade(make_problem(), LOOPING_SOURCE)
+        pool.shutdown()
+        assert [(test.name, test.status) for test in result.tests] == [('answer', 'timeout')]
+
+
+def test_subprocess_runner_limits():
+    pool = GradingPool(1, runner='subprocess',
+                       limits=Limits(test_timeout=0.2, submission_timeout=30, memory=2 ** 30))
+    timed_out = pool.grade(make_problem(), LOOPING_SOURCE)
+    too_big = pool.grade(make_problem(), 'def answer():\n    return len(bytearray(2 ** 31))\n')
+    pool.shutdown()
+    assert [(test.name, test.status) for test in timed_out.tests] == [('answer', 'timeout')]
+    assert timed_out.grading_time < 10  # not killed at the submission timeout
+    assert [(test.name, test.status) for test in too_big.tests] == [('answer', 'memory')]
+
+
+def test_zygote_kills_stubborn_children():
+    pool = GradingPool(1, runner='zygote', limits=Limits(submission_timeout=0.2))
+    result = pool.grade(make_problem(), STUBBORN_SOURCE)
+    pool.shutdown()
+    assert [(test.name, test.status) for test in result.tests] == [('answer', 'timeout')]
+
+
+def test_memory_limit():
+    pool = GradingPool(1, runner='zygote', limits=Limits(memory=2 ** 30))
+    result = pool.grade(make_problem(), 'def answer():\n    return len(bytearray(2 ** 31))\n')
+    pool.shutdown()
+    assert [(test.name, test.status) for test in result.tests] == [('answer', 'memory')]
+
+
+def test_tests_are_materialized_once(tmpdir):
+    problem = make_problem()
+    tests_dir = materialized_tests_dir(problem, str(tmpdir))
+    assert materialized_tests_dir(problem, str(tmpdir)) == tests_dir
+    assert os.listdir(str(tmpdir)) == [os.path.basename(tests_dir)]
+    assert not os.path.exists(problem.source_code_filename(dir=tests_dir))
+    compiled = os.listdir(os.path.join(tests_dir, '__pycache__'))
+    assert sorted(name.split('.')[0] for name in compiled) == [
+        'test_community_cases', 'test_hidden_cases', 'test_public_cases']
+
+
+TAMPERING_SOURCE = """
+import os
+run_dir = os.path.dirname(os.path.abspath(__file__))
+for name in os.listdir(run_dir):
+    if name.startswith('test_'):
+        with open(os.path.join(run_dir, name), 'w') as fd:
+            fd.write('def test_answer():\\n    pass\\n')
+def answer():
+    return 0
+"""
+
+
+def test_materialized_tests_are_not_shared_with_submissions(tmpdir):
+    problem = make_problem()
+    for runner in ('zygote', 'inprocess'):
+        pool = GradingPool(1, scratch_root=str(tmpdir), runner=runner)
+        pool.grade(problem, TAMPERING_SOURCE)
+        honest = pool.grade(problem, 'def answer():\n    return 0\n')
+        pool.shutdown()
+        assert [(test.name, test.status) for test in honest.tests] == [('answer', 'failed')]
+
+
+def test_unready_materialization_is_redone(tmpdir, monkeypatch):
+    problem = make_problem()
+    monkeypatch.setattr('run_pytest.precompile_tests', lambda *_: 1 / 0)
+    try:
+        materialized_tests_dir(problem, str(tmpdir))
+    except ZeroDivisionError:
+        pass
+    assert os.listdir(str(tmpdir)) == []  # partial directory is removed
+    monkeypatch.undo()
+    # directory left by a dead materializer
+    dead = subprocess.Popen(['true'])
+    dead.wait()
+    tests_dir = str(tmpdir.join('problem1-' + problem.test_suite_hash))
+    os.mkdir(tests_dir)
+    with open(os.path.join(tests_dir, MATERIALIZER_FILE), 'w') as fd:
+        fd.write(str(dead.pid))
+    assert materialized_tests_dir(problem, str(tmpdir)) == tests_dir
+    assert os.listdir(str(tmpdir)) == [os.path.basename(tests_dir)]
+    assert os.path.exists(problem.public_test_filename(tests_dir))
+    # directory of unknown origin, never ready
+    shutil.rmtree(tests_dir)
+    os.mkdir(tests_dir)
+    monkeypatch.setattr('run_pytest.MATERIALIZATION_TIMEOUT', 0.1)
+    assert materialized_tests_dir(problem, str(tmpdir)) == tests_dir
+    assert os.path.exists(problem.public_test_filename(tests_dir))
+
+
+def test_run_dir_receives_nothing_but_the_submission(tmpdir):
+    problem, run_dir = make_problem(), str(tmpdir.join('run'))
+    populate_run_dir(problem, 'def answer():\n    return 42\n', run_dir, backup=False)
+    before = sorted(os.listdir(run_dir))
+    result = run_pytest_in_process(problem, 'def answer():\n    return 42\n', run_dir)
+    assert result.total_success
+    assert sorted(os.listdir(run_dir)) == before  # no cache nor bytecode
+    assert os.listdir(str(tmpdir)) == ['run']  # no backup directory
+
+
+def make_large_problem() -> Problem:
+    tests = [WTest("def test_{0}():\n    assert answer() == {0}\n".format(value),
+                   'teacher', type, name='test_{}'.format(value))
+             for value, type in zip(range(40, 46), ('public', 'hidden') * 3)]
+    return Problem(1, 'answer', 'Return 42', tests[::2], tests[1::2])
+
+
+def test_large_suites_are_sharded():
+    problem = make_large_problem()
+    pool = GradingPool(3, sharding_threshold=4)
+    result = pool.grade(problem, 'def answer():\n    return 42\n')
+    pool.shutdown()
+    # order of a full run: hidden tests file, then public tests file
+    assert [(test.name, test.type, test.succeed) for test in result.tests] == [
+        ('41', 'hidden', False), ('43', 'hidden', False), ('45', 'hidden', False),
+        ('40', 'public', False), ('42', 'public', True), ('44', 'public', False),
+    ]
+
+
+def test_dry_run_stops_at_first_failure():
+    problem, source = make_large_problem(), 'def answer():\n    return 42\n'
+    for runner in ('zygote', 'inprocess'):
+        pool = GradingPool(1, runner=runner)
+        result = pool.grade(problem, source, dry=True, priority_tests=('test_42', 'test_44'))
+        pool.shutdown()
+        assert [(test.name, test.succeed) for test in result.tests] == [
+            ('42', True), ('44', False)]
+    pool = GradingPool(1, runner='subprocess')
+    result = pool.grade(problem, source, dry=True)
+    pool.shutdown()
+    assert [(test.name, test.succeed) for test in result.tests] == [('41', False)]
+
+
+def test_trace_is_bounded():
+    source = "def answer():\n    print('spam\\n' * 10 ** 5)\n    return 41\n"
+    for runner in ('subprocess', 'zygote'):
+        pool = GradingPool(1, runner=runner, limits=Limits(trace_size=1000))
+        result = pool.grade(make_problem(), source)
+        pool.shutdown()
+        assert [(test.name, test.status) for test in result.tests] == [('answer', 'failed')]
+        assert len(result.full_trace) < 1100 and 'bytes truncated' in result.full_trace
+
+
+def test_resources_usage_is_measured():
+    for runner in ('subprocess', 'zygote'):
+        pool = GradingPool(1, runner=runner)
+        result = pool.grade(make_problem(), 'def answer():\n    return 42\n')
+        pool.shutdown()
+        assert result.grading_time > 0 and result.cpu_time > 0 and result.peak_memory > 0
+        assert all(test.duration is not None for test in result.tests)
+
+
+def test_inprocess_runner_does_not_report_peak_memory():
+    pool = GradingPool(1, runner='inprocess')
+    result = pool.grade(make_problem(), 'def answer():\n    return 42\n')
+    pool.shutdown()
+    assert result.cpu_time > 0 and result.peak_memory is None  # worker one
+
+
+def test_benchmarks():
+    benchmarks = (Benchmark("def bench_answer(n):\n    for _ in range(n):\n        answer()\n",
+                            'teacher', (10, 100), time_budget=1, repeat=3),
+                  Benchmark("def bench_crash(n):\n    answer(n)\n", 'teacher', (1,), 1))
+    problem = Problem(1, 'answer', 'Return 42', make_problem().tests, (),
+                      benchmarks=benchmarks)
+    for runner in ('subprocess', 'zygote'):
+        pool = GradingPool(1, runner=runner)
+        result = pool.grade(problem, 'def answer():\n    return 42\n')
+        pool.shutdown()
+        assert [(bench.name, bench.status) for bench in result.benchmarks] == [
+            ('bench_answer', 'passed'), ('bench_crash', 'error')]
+        assert [scale for scale, _ in result.benchmarks[0].timings] == [10, 100]
+
+
+FORGING_SOURCE = """
+import os
+forged = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.benchmark_results.json')
+if os.path.exists(forged):  # imported by the benchmarks runner
+    os._exit(0)
+with open(forged, 'w') as fd:
+    fd.write('[{"__weldon_BenchmarkResult__": {"name": "bench_answer", "succeed": true,'
+             ' "status": "passed", "timings": [], "peak_memory": null}}]')
+def answer():
+    return 42
+"""
+
+
+def test_benchmarks_results_can_not_be_forged():
+    benchmark = Benchmark("def bench_answer(n):\n    answer()\n", 'teacher', (1,), 1)
+    problem = Problem(1, 'answer', 'Return 42', make_problem().tests, (),
+                      benchmarks=(benchmark,))
+    pool = GradingPool(1, runner='subprocess')
+    result = pool.grade(problem, FORGING_SOURCE)
+    pool.shutdown()
+    assert [(bench.name, bench.status) for bench in result.benchmarks] == [
+        ('bench_answer', 'error')]
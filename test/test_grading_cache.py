@@ -0,0 +1,55 @@
+
+from commons import BenchmarkResult, SubmissionResult, TestResult as WTestResult
+from problem import Problem
+from grading_cache import GradingCache
+
+
+def make_result(source_code:str) -> SubmissionResult:
+    return SubmissionResult(tests=[], full_trace='', problem_id=1,
+                            source_code=source_code)
+
+
+def test_hits_and_misses():
+    cache = GradingCache(2)
+    problem = Problem(1, 'title', 'desc', (), ())
+    assert cache.get(problem, 'a') is None
+    result = make_result('a')
+    cache.put(problem, 'a', result)
+    assert cache.get(problem, 'a') is result
+    assert cache.get(Problem(2, 'other', 'desc', (), ()), 'a') is None
+    assert cache.stats == {'hits': 1, 'misses': 2, 'size': 1, 'maxsize': 2}
+
+
+def test_lru_eviction():
+    cache = GradingCache(2)
+    problem = Problem(1, 'title', 'desc', (), ())
+    for source in 'abc':
+        cache.put(problem, source, make_result(source))
+        cache.get(problem, 'a')  # keep a as the most recently used
+    assert len(cache) == 2
+    assert cache.get(problem, 'b') is None
+    assert cache.get(problem, 'a') and cache.get(problem, 'c')
+
+
+def test_disabled_cache():
+    cache = GradingCache(0)
+    problem = Problem(1, 'title', 'desc', (), ())
+    cache.put(problem, 'a', make_result('a'))
+    assert cache.get(problem, 'a') is None
+
+
+def test_load_dependent_results_are_not_cached():
+    cache = GradingCache(4)
+    problem = Problem(1, 'title', 'desc', (), ())
+    def result(status:str, benchmark_status:str='passed') -> SubmissionResult:
+        return SubmissionResult(
+            tests=[WTestResult('test_answer', 'public', status == 'passed', status)],
+            full_trace='', problem_id=1, source_code='',
+            benchmarks=[BenchmarkResult('fast_enough', benchmark_status == 'passed',
+                                        benchmark_status)])
+    results = {'a': result('timeout'), 'b': result('memory'),
+               'c': result('passed', 'slow'), 'd': result('failed')}
+    for source, result in results.items():
+        cache.put(problem, source, result)
+    assert [cache.get(problem, source) for source in 'abc'] == [None] * 3
+    assert cache.get(problem, 'd') is results['d']
@@ -0,0 +1,57 @@
+
+import threading
+from commons import SubmissionResult
+from grading_queue import GradingQueue
+
+
+def fake_grade(token:str, problem_id:int, source_code:str) -> SubmissionResult:
+    if source_code == 'crash':
+        raise ValueError('bad code')
+    return SubmissionResult(tests=[], full_trace='', problem_id=problem_id,
+                            source_code=source_code)
+
+
+def wait_for(queue, job):
+    while not job.finished:
+        threading.Event().wait(0.01)
+
+
+def test_jobs_are_graded():
+    queue = GradingQueue(fake_grade, nb_workers=2)
+    good, bad = queue.put('token', 1, 'code'), queue.put('token', 2, 'crash')
+    assert queue.job(good.id) is good
+    for job in (good, bad):
+        wait_for(queue, job)
+    assert good.status == 'done' and good.result.source_code == 'code'
+    assert bad.status == 'failed' and bad.error == 'bad code'
+
+
+def test_old_finished_jobs_are_forgotten():
+    queue = GradingQueue(fake_grade, max_finished_jobs=1)
+    first = queue.put('token', 1, 'first')
+    wait_for(queue, first)
+    second = queue.put('token', 1, 'second')
+    wait_for(queue, second)
+    assert queue.job(first.id) is None
+    assert queue.job(second.id) is second
+
+
+def test_round_robin_and_superseding():
+    graded = []
+    release = threading.Event()
+    def grade(token, problem_id, source_code):
+        release.wait()
+        graded.append(source_code)
+        return fake_grade(token, problem_id, source_code)
+    queue = GradingQueue(grade, nb_workers=1)
+    first = queue.put('alice', 1, 'a0')
+    while first.status != 'running':  # the worker is now blocked on a0
+        threading.Event().wait(0.01)
+    jobs = [queue.put('alice', 1, 'a1'), queue.put('alice', 2, 'a2'),
+            queue.put('alice', 1, 'a3'), queue.put('bob', 1, 'b1')]
+    assert jobs[0].status == 'superseded' and jobs[0].superseded_by == jobs[2].id
+    assert len(queue) == 3
+    release.set()
+    for job in jobs[1:]:
+        assert job.wait(5)
+    assert graded == ['a0', 'a2', 'b1', 'a3']
@@ -0,0 +1,50 @@
+import os
+
+from wtest import Test as WTest
+from journal import Journal, SNAPSHOT_FILE
+
+
+TEST_CODE = 'def test_answer():\n    assert answer() == 42\n'
+
+
+def test_events_are_replayed(tmpdir):
+    journal = Journal(str(tmpdir))
+    assert journal.recover() == (None, [])
+    journal.wait(journal.append('session', 1, True))
+    journal.append('test', 1, WTest(TEST_CODE, 'alice', 'public', name='test_answer'))
+    journal.close()
+    state, events = Journal(str(tmpdir)).recover()
+    assert state is None
+    assert events[0] == ['session', 1, True]
+    assert events[1][0] == 'test' and events[1][2].name == 'test_answer'
+
+
+def test_snapshot_covers_previous_events(tmpdir):
+    journal = Journal(str(tmpdir), snapshot_interval=2)
+    journal.recover()
+    journal.append('session', 1, True)
+    journal.append('session', 1, False)
+    assert journal.snapshot_needed
+    journal.write_snapshot({'open_problems': []}, journal.rotate())
+    assert not journal.snapshot_needed
+    journal.append('session', 2, True)
+    journal.close()
+    assert len(os.listdir(str(tmpdir))) == 2  # the snapshot and the new journal
+    assert SNAPSHOT_FILE in os.listdir(str(tmpdir))
+    state, events = Journal(str(tmpdir)).recover()
+    assert state == {'open_problems': []}
+    assert events == [['session', 2, True]]
+
+
+def test_interrupted_write_is_ignored(tmpdir):
+    journal = Journal(str(tmpdir))
+    journal.recover()
+    journal.append('session', 1, True)
+    journal.close()
+    path, = (tmpdir.join(name) for name in os.listdir(str(tmpdir)))
+    with open(str(path), 'a') as fd:
+        fd.write('[2, "sess')
+    journal = Journal(str(tmpdir))
+    assert journal.recover() == (None, [['session', 1, True]])
+    assert journal.append('session', 2, False) == 2
+    journal.close()
@@ -0,0 +1,50 @@
+import wjson
+from wtest import Test as WTest
+from problem import Problem
+
+
+def make_test(name:str, type:str) -> WTest:
+    return WTest('def {}():\n    assert answer() == 42\n'.format(name), 'alice', type, name=name)
+
+
+def test_added_tests_are_indexed():
+    problem = Problem(1, 'answer', 'find it', [make_test('test_public', 'public')], ())
+    tests = problem.tests
+    assert problem.tests is tests  # computed once
+    problem = problem.with_test(make_test('test_community', 'community'))
+    assert problem.version == 2
+    assert problem.have_test('test_community') and not problem.have_test('test_other')
+    assert problem.test('test_public').type == 'public'
+    assert [test.name for test in problem.tests] == ['test_public', 'test_community']
+    assert problem.public_tests == tests
+
+
+def test_versions_share_tests():
+    first = Problem(1, 'answer', 'find it', [make_test('test_public', 'public')], ())
+    second = first.with_test(make_test('test_second', 'community'))
+    third = second.with_test(make_test('test_third', 'community'))
+    assert not first.have_test('test_second') and first.community_tests == ()
+    assert not second.have_test('test_third') and second.have_test('test_second')
+    assert len(third.community_tests) == 2
+    # a version that is not the last one gives its own tests
+    other = second.with_test(make_test('test_other', 'hidden'))
+    assert [test.name for test in other.tests] == ['test_public', 'test_other', 'test_second']
+    assert not third.have_test('test_other') and not other.have_test('test_third')
+
+
+def test_public_data_is_computed_once():
+    problem = Problem(1, 'answer', 'find it', [make_test('test_public', 'public')],
+                      [make_test('test_hidden', 'hidden')])
+    public = problem.as_public_data()
+    assert problem.as_public_data() is public
+    assert wjson.as_json(public) is wjson.as_json(public)
+    assert problem.with_test(make_test('test_new', 'public')).as_public_data() is not public
+
+
+def test_json_keeps_tests():
+    problem = Problem(1, 'answer', 'find it', [make_test('test_public', 'public')],
+                      [make_test('test_hidden', 'hidden')])
+    problem = wjson.from_json(wjson.as_json(problem))
+    assert set(problem.fields) == set(Problem.FIELDS)
+    assert problem.have_test('test_hidden')
+    assert problem.as_public_data().hidden_tests == ()
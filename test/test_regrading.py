@@ -0,0 +1,38 @@
+
+from concurrent.futures import Future
+from wtest import Test as WTest
+from problem import Problem
+from commons import SubmissionResult, TestResult as WTestResult
+from regrading import Regrading
+
+
+def make_submission(source_code:str, tests) -> SubmissionResult:
+    return SubmissionResult(tests=list(tests), full_trace='', problem_id=1,
+                            source_code=source_code)
+
+
+def test_regrading_merges_new_tests():
+    new_test = WTest("def test_new():\n    assert f()\n", 'teacher', 'hidden',
+                     name='test_new')
+    problem = Problem(1, 'title', 'desc', (), (new_test,))
+    submissions = {
+        'alice': make_submission('good', [WTestResult('old', 'public', True)]),
+        'bob': make_submission('bad', [WTestResult('old', 'public', False)]),
+    }
+    def submit(problem, source_code):
+        assert [test.name for test in problem.tests] == ['test_new']
+        future = Future()
+        future.set_result(make_submission(source_code, [
+            WTestResult('new', 'hidden', source_code == 'good')
+        ]))
+        return future
+    stored = {}
+    first = Regrading(problem, (new_test,), lambda: submissions, submit,
+                      lambda token, last, result: stored.__setitem__(token, (last, result)))
+    second = Regrading(problem, (), dict, submit, None, previous=first)
+    second.join()
+    assert not first.running
+    assert first.status['done'] == first.status['total'] == 2
+    assert stored['alice'][0] is submissions['alice']
+    assert [(test.name, test.succeed) for test in stored['alice'][1].tests] == [('old', True), ('new', True)]
+    assert [(test.name, test.succeed) for test in stored['bob'][1].tests] == [('old', False), ('new', False)]
@@ -0,0 +1,54 @@
+from storage import MemoryStorage, SQLiteStorage
+from retention import Compactor, RetentionPolicy, KEEP_ALL, submission_summary
+
+from .test_storage import make_result
+
+
+def check_compaction(storage):
+    for source in ('a', 'b', 'c'):
+        storage.add_submission('alice', make_result(1, source))
+    storage.add_submission('bob', make_result(2, 'd'))
+    policies = {1: RetentionPolicy(full_submissions=1, drop_closed=False),
+                2: KEEP_ALL}
+    closed = set()
+    compactor = Compactor(storage, lambda: ((problem_id, policy, problem_id in closed)
+                                            for problem_id, policy in policies.items()),
+                          interval=3600)
+    assert compactor.compact() == 2
+    assert compactor.compact() == 0  # already compacted
+    submissions = storage.submissions('alice', 1)
+    assert [sub.source_code for sub in submissions] == ['', '', 'c']
+    assert [sub.full_trace for sub in submissions] == ['', '', 'trace']
+    # summaries keep what player reports need
+    assert [[test.succeed for test in sub.tests] for sub in submissions] == [[True, False]] * 3
+    assert submissions[0].grading_time == 0.5
+    assert submissions[0].tests[0].status is None and not submissions[0].benchmarks
+    assert storage.last_submission('alice', 1).tests[0].status == 'passed'
+
+    policies[2] = RetentionPolicy(full_submissions=None, drop_closed=True)
+    compactor.compact()
+    assert storage.nb_submissions('bob', 2) == 1  # not closed yet
+    closed.add(2)
+    compactor.compact()
+    assert storage.nb_submissions('bob', 2) == 0
+    assert storage.nb_submissions('alice', 1) == 3
+    compactor.stop()
+
+
+def test_memory_compaction():
+    storage = MemoryStorage()
+    check_compaction(storage)
+    assert len(storage.blobs) == 2  # source c and the trace
+
+
+def test_sqlite_compaction(tmpdir):
+    storage = SQLiteStorage(str(tmpdir.join('weldon.sqlite')))
+    check_compaction(storage)
+    storage.close()
+
+
+def test_summary_shares_test_results():
+    first = submission_summary(make_result(1, 'a'))
+    second = submission_summary(make_result(1, 'b'))
+    assert first.tests[0] is second.tests[0]
+    assert first.source_code == first.full_trace == ''
@@ -0,0 +1,134 @@
+import sqlite3
+import threading
+import wjson
+import webclient
+from commons import ServerError
+from wtest import Test as WTest
+from server import Server
+from retention import RetentionPolicy
+from webclient import create_batch_payload, create_payload, extract_payload
+
+
+TEST = WTest("def test_answer():\n    assert answer() == 42\n",
+             'teacher', 'public', name='test_answer')
+INVALID_TEST = "def test_nothing():\n    pass\n"  # nothing asserted
+
+
+def register(token:str, title:str, tests) -> tuple:
+    return ('register_problem', (), {
+        'token': token, 'title': title, 'description': 'Return 42',
+        'public_tests': tests, 'hidden_tests': (),
+    })
+
+
+def test_batch_reports_each_command():
+    server = Server(rooter_password='root')
+    token = server.register_rooter('teacher', 'root')
+    answer = wjson.from_json(server.handle_transaction(create_batch_payload([
+        register(token, 'first', [TEST]),
+        register(token, 'second', [INVALID_TEST]),
+        ('list_problems', (), {'token': token}),
+        ('unknown', (), {}),
+    ])))
+    results = wjson.from_json(extract_payload(answer))
+    server.close()
+    assert [result['status'] for result in results] == ['succeed', 'failed', 'succeed', 'failed']
+    assert wjson.from_json(extract_payload(results[0])).title == 'first'
+    assert results[1]['payload'].startswith('SourceError')
+    assert wjson.from_json(extract_payload(results[2])) == ['first']
+    assert results[3]['payload'] == 'Unknow command.'
+
+
+def test_single_command_is_not_batched():
+    server = Server(rooter_password='root')
+    token = server.register_rooter('teacher', 'root')
+    answer = wjson.from_json(server.handle_transaction(
+        create_payload('list_problems', token=token)))
+    unknown = wjson.from_json(server.handle_transaction(create_payload('unknown')))
+    server.close()
+    assert wjson.from_json(extract_payload(answer)) == []
+    assert unknown['status'] == 'failed'
+
+
+def test_submissions_after_export_are_not_dropped(tmpdir):
+    options = {'player_password': 'player', 'rooter_password': 'root',
+               'retention_policy': RetentionPolicy(None, drop_closed=True),
+               'database': str(tmpdir.join('weldon.sqlite')),
+               'journal': str(tmpdir.join('journal'))}
+    server = Server(**options)
+    rooter = server.register_rooter('teacher', 'root')
+    player = server.register_player('student', 'player')
+    problem = server.register_problem(rooter, 'answer', 'Return 42', [TEST], ())
+    server.submit_solution(player, problem.id, 'def answer():\n    return 41\n')
+    assert len(server.retrieve_submissions(rooter, problem.id)[player]) == 1
+    server.submit_solution(player, problem.id, 'def answer():\n    return 42\n')
+    server.close_problem_session(rooter, problem.id)
+    server.close()
+    server = Server(**options)  # the journal knows the last one was not retrieved
+    server._compactor.compact()
+    assert server._db.nb_submissions(player, problem.id) == 2
+    assert len(server.retrieve_submissions(rooter, problem.id)[player]) == 2
+    server._compactor.compact()
+    assert server._db.nb_submissions(player, problem.id) == 0
+    server.close()
+
+
+def test_client_methods_use_server_defaults(monkeypatch):
+    server = Server(rooter_password='root')
+    monkeypatch.setattr(webclient, 'send', lambda payload, **_: wjson.from_json(
+        server.handle_transaction(payload)))
+    client = webclient.Send('root', 'teacher', root=True)
+    problem = client.register_problem('answer', 'Return 42', public_tests=[TEST],
+                                      hidden_tests=())  # no benchmarks given
+    try:
+        client.register_problem('other', 'Return 42')
+        assert False, "missing tests were not detected"
+    except ServerError:
+        pass
+    server.close()
+    assert problem.benchmarks == ()
+
+
+def test_concurrent_uploads_of_same_test(monkeypatch):
+    server = Server(rooter_password='root', player_password='player')
+    rooter = server.register_rooter('teacher', 'root')
+    player = server.register_player('student', 'player')
+    problem = server.register_problem(rooter, 'answer', 'Return 42', [TEST], ())
+    server.submit_solution(player, problem.id, 'def answer():\n    return 42\n')
+    both_checked = threading.Barrier(2, timeout=30)
+    run_new_tests = server._run_new_tests_for_player
+    def run_new_tests_together(*args, **kwargs):  # both uploads passed the name check
+        result = run_new_tests(*args, **kwargs)
+        both_checked.wait()
+        return result
+    monkeypatch.setattr(server, '_run_new_tests_for_player', run_new_tests_together)
+    errors = []
+    def upload():
+        try:
+            server.submit_test(player, problem.id, "def test_again():\n"
+                               "    if answer() != 42:\n        raise AssertionError\n")
+        except Exception as error:
+            errors.append(error)
+    threads = [threading.Thread(target=upload) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server._regradings[problem.id]._thread.join()
+    server.close()
+    assert len(errors) == 1 and isinstance(errors[0], ServerError), errors
+    assert len(server.problems_by_id[problem.id].community_tests) == 1
+
+
+def test_submissions_are_written_before_returning(tmpdir):
+    database = str(tmpdir.join('weldon.sqlite'))
+    server = Server(player_password='player', rooter_password='root', database=database)
+    rooter = server.register_rooter('teacher', 'root')
+    player = server.register_player('student', 'player')
+    problem = server.register_problem(rooter, 'answer', 'Return 42', [TEST], ())
+    server.submit_solution(player, problem.id, 'def answer():\n    return 42\n')
+    connection = sqlite3.connect(database)  # as after a crash
+    nb_submissions = connection.execute('SELECT COUNT(*) FROM submissions').fetchone()[0]
+    connection.close()
+    server.close()
+    assert nb_submissions == 1
@@ -0,0 +1,74 @@
+from commons import SubmissionResult, TestResult as WTestResult, BenchmarkResult
+from storage import MemoryStorage, SQLiteStorage, BlobStore
+
+
+def make_result(problem_id:int, source_code:str) -> SubmissionResult:
+    return SubmissionResult(tests=[WTestResult('answer', 'public', True, 'passed', 0.1),
+                                   WTestResult('other', 'hidden', False, 'failed', 0.2)],
+                            full_trace='trace', problem_id=problem_id,
+                            source_code=source_code, grading_time=0.5,
+                            benchmarks=[BenchmarkResult('bench_answer', True, 'passed',
+                                                        [[10, 0.01]])])
+
+
+def check_storage(storage):
+    assert storage.last_submission('alice', 1) is None
+    assert storage.submissions('alice', 1) == ()
+    for source in ('a', 'b'):
+        storage.add_submission('alice', make_result(1, source))
+    storage.add_submission('bob', make_result(2, 'c'))
+    assert [sub.source_code for sub in storage.submissions('alice', 1)] == ['a', 'b']
+    last = storage.last_submission('alice', 1)
+    assert last.source_code == 'b' and last.grading_time == 0.5
+    assert [(test.name, test.status) for test in last.tests] == [
+        ('answer', 'passed'), ('other', 'failed')]
+    assert last.benchmarks[0].name == 'bench_answer'
+    assert storage.nb_submissions('alice', 1) == 2
+    assert tuple(storage.tokens_of(1)) == ('alice',)
+    assert tuple(storage.problems_of('bob')) == (2,)
+    assert tuple(storage.problems_of('carol')) == ()
+
+
+def test_memory_storage():
+    storage = MemoryStorage()
+    check_storage(storage)
+    assert len(storage.blobs) == 4  # sources a, b, c and the shared trace
+
+
+def test_blob_store():
+    store = BlobStore()
+    trace = 'test_answer PASSED\n' * 1000
+    first, second = store.put(trace), store.put(trace)
+    assert first is second and len(store) == 1
+    assert store.size < len(trace) // 10
+    store.release(first)
+    assert len(store) == 1
+    store.release(second)
+    assert len(store) == 0
+    assert first.text == trace  # still readable by its holders
+
+
+def test_sqlite_storage(tmpdir):
+    path = str(tmpdir.join('weldon.sqlite'))
+    storage = SQLiteStorage(path, batch_size=2)
+    check_storage(storage)
+    storage.add_submission('alice', make_result(1, 'd'))
+    storage.close()  # pending submission is written
+    storage = SQLiteStorage(path)
+    assert [sub.source_code for sub in storage.submissions('alice', 1)] == ['a', 'b', 'd']
+    storage.close()
+
+
+def test_sqlite_storage_order_and_queries(tmpdir, monkeypatch):
+    storage = SQLiteStorage(str(tmpdir.join('weldon.sqlite')))
+    clock = iter((100., 50.))  # clock stepping backward
+    monkeypatch.setattr('storage.time.time', lambda: next(clock))
+    for source in ('a', 'b'):
+        storage.add_submission('alice', make_result(1, source))
+    storage.flush()
+    queries = []
+    storage._connection.set_trace_callback(queries.append)
+    assert [sub.source_code for sub in storage.submissions('alice', 1)] == ['a', 'b']
+    assert len(queries) == 2  # submissions, then all their tests
+    assert storage.last_submission('alice', 1).source_code == 'b'
+    storage.close()
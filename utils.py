@@ -1,10 +1,11 @@
 """Definition of helpers functions"""
 
+import sys
 import json
 
 
 def jsonable_class(name:str, slots:iter, bases:iter=[], other_attributes={},
-                   repr_as_str:bool=True):
+                   repr_as_str:bool=True, module:str=None, defaults={}):
     """Return a class of given name and slots and bases and other_attributes.
 
     This class will implement a json conversion, allowing the object
@@ -15,6 +16,10 @@ def jsonable_class(name:str, slots:iter, bases:iter=[], other_attributes={},
     bases -- base classes
     other_attributes -- mapping name: value for additional attributes
     repr_as_str -- define __repr__ to behave like __str__
+    module -- module name of the class ; default to the caller's module,
+              allowing instances to be pickled (and sent to grading workers)
+    defaults -- mapping field: default value for optional fields,
+                that must be the last ones
 
     Note that another way to provides other attributes is to subclass
     the class returned by this function.
@@ -23,20 +28,23 @@ def jsonable_class(name:str, slots:iter, bases:iter=[], other_attributes={},
     if isinstance(slots, str):
         # broke up into pieces
         slots = tuple(map(str.strip, slots.split(',')))
+    if module is None:  # same trick as collections.namedtuple
+        module = sys._getframe(1).f_globals.get('__name__', '__main__')
 
-    def build(name, slots, other_attributes):
+    def build(name, slots, other_attributes, defaults):
         slots = tuple(slots)
         fields = tuple(field.lstrip('_') for field in slots)
         json_id = '__weldon_{}__'.format(name)
         constructor_def = """def constructor(self, {}):{}""".format(
-            ', '.join(fields),
+            ', '.join(field + ('=defaults[{!r}]'.format(field) if field in defaults else '')
+                      for field in fields),
             '\n '+'\n '.join('self.{} = {}'.format(slot, slot.lstrip('_'))
                           for slot in slots) + '\n',
         )
-        exec(constructor_def)  # get the function
-        # for obscur reason, constructor is in locals but just accessing
-        #  the variable do not works. So here's a patch
-        constructor_func = locals()['constructor']
+        # defaults values are looked up in the namespace of the definition
+        namespace = {'defaults': dict(defaults)}
+        exec(constructor_def, namespace)  # get the function
+        constructor_func = namespace['constructor']
         def to_json(self):
             return {json_id: {
                 field: getattr(self, field)
@@ -59,6 +67,7 @@ def jsonable_class(name:str, slots:iter, bases:iter=[], other_attributes={},
         def to_string(self):
             return '<{} {}>'.format(name, ' '.join('{}={}'.format(field, getattr(self, field)) for field in self.fields))
         attributes = {
+            '__module__': module,
             '__init__': constructor_func,
             '__slots__': slots,
             '__str__': to_string,
@@ -76,7 +85,7 @@ def jsonable_class(name:str, slots:iter, bases:iter=[], other_attributes={},
         if repr_as_str:
             attributes['__repr__'] = to_string
         return type(name, tuple(bases), attributes)
-    return build(name, slots, other_attributes or {})
+    return build(name, slots, other_attributes or {}, defaults or {})
 
 
 def custom_json_encoder(cls:type or [type]) -> json.JSONEncoder:
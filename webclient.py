@@ -2,6 +2,8 @@
 import socket
 import base64
 import inspect
+from contextlib import contextmanager
+from concurrent.futures import Future
 
 import wjson
 from server import Server
@@ -11,6 +13,7 @@ from hybrid_encryption import HybridEncryption
 
 
 TCP_IP = '127.0.0.1'
+OMITTED = object()  # value of parameters not given to generated API methods
 
 
 def create_payload(function:str, *args:str, keypair=None, server_pubkey=None, **kwargs) -> bytes:
@@ -19,7 +22,25 @@ def create_payload(function:str, *args:str, keypair=None, server_pubkey=None, **
     Will encrypt it if keypair and server public key are given.
 
     """
-    payload = wjson.as_json((function, tuple(args), dict(kwargs)))
+    return encrypted_payload(wjson.as_json((function, tuple(args), dict(kwargs))),
+                             keypair=keypair, server_pubkey=server_pubkey)
+
+
+def create_batch_payload(commands:[(str, tuple, dict)], keypair=None, server_pubkey=None) -> bytes:
+    """Create and return the payload running all given commands
+    (function, args, kwargs) in one transaction.
+
+    Will encrypt it if keypair and server public key are given.
+
+    """
+    payload = wjson.as_json([(function, tuple(args), dict(kwargs))
+                             for function, args, kwargs in commands])
+    return encrypted_payload(payload, keypair=keypair, server_pubkey=server_pubkey)
+
+
+def encrypted_payload(payload:str, keypair=None, server_pubkey=None) -> bytes:
+    """Return the data to send for given json payload,
+    encrypted if keypair and server public key are given"""
     key = None
     if keypair and server_pubkey:
         payload, key = keypair.encrypt(payload, server_pubkey)
@@ -95,6 +116,7 @@ class Send:
         self.keypair = keypair
         self.registration_password = str(registration_password)
         self.known_params = {'token', 'problem', 'problem_id'}
+        self._batch = None  # (command, kwargs, Future) waiting to be sent
         self.get_server_pubkey()
         self.register()
         self.implement_api()
@@ -120,6 +142,7 @@ class Send:
         """Will ask the server about available API.
         Will dynamically create the methods for self with the parameters
         that are not deductible from already known information (notabily token).
+        Parameters not given are not sent, so the server defaults apply.
 
         This method uses black magic.
         See https://stackoverflow.com/a/2982/3077939 for details.
@@ -136,7 +159,8 @@ class Send:
             known_params = tuple(param for param in params if param in self.known_params)
             # generate the method definition
             method_def = "def {}(self, {} **kwargs):\n return self._send('{}', {}{}{})".format(
-                method_name, ', '.join(method_params) + ',' if method_params else '',
+                method_name, ', '.join(param + '=OMITTED' for param in method_params) + ','
+                if method_params else '',
                 method_name,
                 ', '.join('{p}=kwargs.get("{p}", self.{p})'.format(p=param) for param in known_params),
                 ', ' if known_params else '',
@@ -148,8 +172,43 @@ class Send:
             setattr(self, method_name, locals()[method_name].__get__(self))
 
 
+    @contextmanager
+    def batch(self):
+        """Context in which requests are not sent, but sent all together
+        in one transaction at the end of the context.
+
+        Requests made in the context return a Future, giving the result
+        (or raising the ServerError) once the context is left.
+
+        """
+        assert self._batch is None, "batches can't be nested"
+        self._batch = []
+        try:
+            yield self
+            batch = self._batch
+        finally:
+            self._batch = None
+        if not batch:
+            return
+        payload = create_batch_payload(((command, (), kwargs) for command, kwargs, _ in batch),
+                                       keypair=self.keypair, server_pubkey=self.server_pubkey)
+        results = wjson.from_json(extract_payload(send(
+            payload, port=self.port,
+            buffer_size=self.buffer_size, host=self.host
+        ), keypair=self.keypair))
+        for (_, _, future), result in zip(batch, results):
+            try:
+                future.set_result(wjson.from_json(extract_payload(result)))
+            except ServerError as err:
+                future.set_exception(err)
+
     def _send(self, command, **kwargs):
-        """Send request to the server"""
+        """Send request to the server, or add it to the current batch"""
+        kwargs = {name: value for name, value in kwargs.items() if value is not OMITTED}
+        if self._batch is not None:
+            future = Future()
+            self._batch.append((command, dict(kwargs), future))
+            return future
         kwargs = dict(kwargs)
         kwargs.update({'keypair': self.keypair, 'server_pubkey': self.server_pubkey})    # py 3.4 compatibility
         payload = create_payload(command, **kwargs)
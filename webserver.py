@@ -41,7 +41,9 @@ class WebInterface:
             def handle(slf):
                 slf.wfile.write(self.handle(slf.rfile.readline().decode().strip()).encode())
 
-        server = socketserver.TCPServer((self._ip, self._port), TCPHandler)
+        # one thread per connection: a long grading do not block other requests
+        server = socketserver.ThreadingTCPServer((self._ip, self._port), TCPHandler)
+        server.daemon_threads = True
         server.serve_forever()
 
 
@@ -6,15 +6,25 @@ classes of weldon project.
 import json
 from wtest import Test
 from problem import Problem
-from commons import SubmissionResult, TestResult
+from benchmark import Benchmark
+from commons import SubmissionResult, TestResult, BenchmarkResult
 from utils import custom_json_encoder, custom_json_decoder
 
 
-SERIALIZABLE_CLASSES = (Problem, Test, SubmissionResult, TestResult)
+SERIALIZABLE_CLASSES = (Problem, Test, Benchmark, SubmissionResult, TestResult,
+                        BenchmarkResult)
 
 
 def from_json(payload:str) -> object or list or dict:
     return json.loads(payload, object_hook=custom_json_decoder(SERIALIZABLE_CLASSES))
 
 def as_json(payload:object or list or dict) -> str:
-    return json.dumps(payload, cls=custom_json_encoder(SERIALIZABLE_CLASSES)) + '\n'
+    if isinstance(payload, Problem):  # immutable: serialized once per version
+        return payload.cached('json', lambda: _as_json(payload))
+    return _as_json(payload)
+
+def _as_json(payload:object or list or dict) -> str:
+    return json.dumps(payload, cls=_ENCODER) + '\n'
+
+
+_ENCODER = custom_json_encoder(SERIALIZABLE_CLASSES)
@@ -0,0 +1,259 @@
+"""Implementation of the zygote grader processes.
+
+A zygote is a process dedicated to a given version of a problem.
+It imports pytest and materializes the precompiled test modules of the
+problem once, then forks a fresh child for each submission,
+so only the student module has to be loaded by the child.
+
+Children are disposable: resources limits are applied to them,
+and they are killed when running longer than allowed.
+
+Zygotes are not forked from the server, which would give its whole state
+(passwords, tokens, keys, submissions) to the student code: they are
+started by a fork server, a clean process only importing the grading modules.
+
+"""
+
+import os
+import time
+import signal
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from multiprocessing.connection import Connection, wait
+from concurrent.futures import Future
+
+from commons import SubmissionResult
+from run_pytest import (NO_LIMITS, Limits, apply_rlimits, populate_run_dir,
+                        materialized_tests_dir, run_pytest_in_process,
+                        status_of_killed_grader, with_missing_tests,
+                        with_resources_usage)
+
+
+HARD_TIMEOUT_GRACE = 1.  # seconds given to a child to report its own timeout
+# context of the processes running student code, started without the server state
+CLEAN_CONTEXT = multiprocessing.get_context('forkserver')
+CLEAN_CONTEXT.set_forkserver_preload(['grading', 'zygote', 'run_pytest'])
+
+
+class Zygote:
+    """Handle on a zygote process, usable from many threads.
+
+    Jobs sent to the zygote are identified by an integer, used to route
+    the results sent back by the zygote to the right Future.
+
+    """
+
+    def __init__(self, problem, scratch_root:str=None, max_children:int=None,
+                 limits:Limits=NO_LIMITS, tests_cache:str=None):
+        """
+        problem -- the problem whose tests will be run by children
+        scratch_root -- directory where job directories are created
+        max_children -- maximal number of jobs run at the same time
+        limits -- the run_pytest.Limits applied to children
+        tests_cache -- directory where tests are materialized
+                       (default: a directory owned by the zygote)
+
+        """
+        self.problem = problem
+        self.scratch_root = scratch_root
+        self.max_children = int(max_children or os.cpu_count() or 1)
+        self._own_tests_cache = tests_cache is None
+        if self._own_tests_cache:
+            tests_cache = tempfile.mkdtemp(prefix='weldon-zygote-', dir=scratch_root)
+        self.tests_cache = tests_cache
+        self._conn, zygote_conn = CLEAN_CONTEXT.Pipe()
+        self._process = CLEAN_CONTEXT.Process(
+            target=_zygote_main, daemon=True,
+            args=(zygote_conn, problem, tests_cache,
+                  scratch_root, self.max_children, limits),
+        )
+        self._process.start()
+        zygote_conn.close()
+        self._futures = {}  # job id: Future
+        self._next_job_id = 0
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_results, daemon=True)
+        self._reader.start()
+
+    def submit(self, source_code:str, *, dry:bool=False,
+               priority_tests:tuple=()) -> Future:
+        """Return a future on the SubmissionResult of given source code
+        (see run_pytest.result_from_pytest for dry and priority_tests).
+
+        """
+        future = Future()
+        with self._lock:
+            job_id, self._next_job_id = self._next_job_id, self._next_job_id + 1
+            try:
+                self._conn.send((job_id, str(source_code), bool(dry), tuple(priority_tests)))
+            except OSError:  # zygote is dead
+                future.set_exception(RuntimeError("Zygote stopped before job completion"))
+            else:
+                self._futures[job_id] = future
+        return future
+
+    def grade(self, source_code:str, **kwargs) -> SubmissionResult:
+        """Return the SubmissionResult of given source code, once computed"""
+        return self.submit(source_code, **kwargs).result()
+
+    @property
+    def alive(self) -> bool:
+        """False if the zygote is dead, and will not accept jobs anymore"""
+        return not self._conn.closed and self._process.is_alive()
+
+    def close(self):
+        """Stop the zygote ; running jobs will be finished before"""
+        with self._lock:
+            if not self._conn.closed:
+                try:
+                    self._conn.send(None)
+                except OSError:  # zygote is dead
+                    pass
+        self._reader.join()
+        self._process.join()
+        if self._own_tests_cache:
+            shutil.rmtree(self.tests_cache, ignore_errors=True)
+
+    def _read_results(self):
+        """Give to futures the results sent back by the zygote.
+        Once the zygote stopped, jobs without result are failed."""
+        try:
+            while True:
+                try:
+                    message = self._conn.recv()
+                except (EOFError, OSError):  # zygote is dead
+                    message = None
+                if message is None:
+                    break
+                job_id, result = message
+                with self._lock:
+                    future = self._futures.pop(job_id)
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            with self._lock:
+                self._conn.close()
+                futures, self._futures = tuple(self._futures.values()), {}
+            for future in futures:
+                future.set_exception(RuntimeError("Zygote stopped before job completion"))
+
+
+def _zygote_main(conn:Connection, problem, tests_cache:str,
+                 scratch_root:str, max_children:int, limits:Limits):
+    """Main of the zygote process, ending silently if the server is gone"""
+    try:
+        _zygote_loop(conn, problem, tests_cache, scratch_root, max_children, limits)
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+
+
+def _zygote_loop(conn:Connection, problem, tests_cache:str,
+                 scratch_root:str, max_children:int, limits:Limits):
+    """Main loop of the zygote process: materialize the tests,
+    then fork a child for each received job.
+
+    """
+    tests_dir = materialized_tests_dir(problem, tests_cache)
+    children = {}  # read end of the child result pipe: (pid, job id, source code, deadline, run dir)
+    pending = []  # received jobs waiting for a free child slot
+    running = True
+    while running or pending or children:
+        while pending and len(children) < max_children:
+            job_id, source_code, dry, priority_tests = pending.pop(0)
+            reader, writer = multiprocessing.Pipe(duplex=False)
+            # created by the zygote, so it is removed even if the child is killed
+            run_dir = tempfile.mkdtemp(prefix='weldon-run-', dir=scratch_root)
+            pid = os.fork()
+            if pid == 0:  # child: only job is to run the tests
+                reader.close()
+                conn.close()
+                apply_rlimits(limits)
+                result = _run_child(problem, source_code, tests_dir,
+                                    run_dir, limits, dry, priority_tests)
+                try:
+                    writer.send(result)
+                except Exception as err:  # result is not picklable
+                    writer.send(RuntimeError(repr(err)))
+                writer.close()
+                os._exit(0)
+            writer.close()
+            start, deadline = time.monotonic(), None
+            if limits.submission_timeout is not None:
+                deadline = start + limits.submission_timeout + HARD_TIMEOUT_GRACE
+            children[reader] = pid, job_id, source_code, start, deadline, run_dir
+        deadlines = [child[4] for child in children.values() if child[4] is not None]
+        timeout = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+        for ready in wait(([conn] if running else []) + list(children), timeout):
+            if ready is conn:
+                try:
+                    job = conn.recv()
+                except EOFError:
+                    job = None
+                if job is None:  # no more jobs will be sent
+                    running = False
+                else:
+                    pending.append(job)
+            else:
+                pid, job_id, source_code, start, _, run_dir = children.pop(ready)
+                try:
+                    result = ready.recv()
+                except EOFError:
+                    result = None
+                ready.close()
+                _, exit_status, usage = os.wait4(pid, 0)
+                shutil.rmtree(run_dir, ignore_errors=True)
+                if result is None:  # child died, maybe killed by a limit
+                    result = _killed_child_result(problem, source_code, exit_status,
+                                                  usage, time.monotonic() - start)
+                conn.send((job_id, result))
+        for reader, (pid, job_id, source_code, start, deadline, run_dir) in tuple(children.items()):
+            if deadline is not None and deadline < time.monotonic():
+                os.kill(pid, signal.SIGKILL)
+                _, _, usage = os.wait4(pid, 0)
+                shutil.rmtree(run_dir, ignore_errors=True)
+                reader.close()
+                del children[reader]
+                conn.send((job_id, _killed_child_result(problem, source_code, -signal.SIGKILL,
+                                                        usage, time.monotonic() - start)))
+    conn.send(None)
+    conn.close()
+
+
+def _killed_child_result(problem, source_code:str, exit_status:int,
+                         usage=None, grading_time:float=None) -> SubmissionResult or Exception:
+    """Return the result of a child that died with given exit status
+    (as returned by os.waitpid, or a negative signal number),
+    after given time and using given resources (see os.wait4).
+
+    """
+    if exit_status > 0 and os.WIFSIGNALED(exit_status):
+        exit_status = -os.WTERMSIG(exit_status)
+    status = status_of_killed_grader(exit_status)
+    if status is None:
+        return RuntimeError("Grader child died without result")
+    empty = SubmissionResult(tests=[], full_trace='Grader was killed ({}).'.format(status),
+                             problem_id=problem.id, source_code=source_code)
+    if usage is not None:
+        empty = with_resources_usage(empty, grading_time, usage)
+    return with_missing_tests(empty, problem, status)
+
+
+def _run_child(problem, source_code:str, tests_dir:str, run_dir:str,
+               limits:Limits, dry:bool=False,
+               priority_tests:tuple=()) -> SubmissionResult or Exception:
+    """Run the tests of problem on given source code, in given empty run
+    directory receiving a copy of the materialized tests.
+    Return the result, or the exception raised.
+
+    """
+    try:
+        populate_run_dir(problem, source_code, run_dir, backup=False,
+                         tests_dir=tests_dir)
+        return run_pytest_in_process(problem, source_code, run_dir, limits,
+                                     dry=dry, priority_tests=priority_tests)
+    except Exception as err:
+        return err